@@ -0,0 +1,168 @@
+#########################
+# Automated Foosball    #
+#########################
+
+# Pipeline benchmark
+# Feeds a fixed corpus of recorded frames through each stage of the vision pipeline
+# and reports per-stage latency (p50/p95/p99) and overall throughput.
+# This runs headless, without a camera or GPIO, so it can be used on any machine.
+
+# USAGE
+# python bench/pipeline.py --input output.avi
+# python bench/pipeline.py --input frames/ --repeat 5 --json results.json
+# python bench/pipeline.py --input output.avi --json new.json --compare old.json
+
+# import the necessary packages
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from foosball import Foosball
+from replay import replayStream
+
+
+# Recorded frames are timestamped as if captured at this FPS, so ball motion does not depend on benchmark speed
+FRAMERATE = 30
+
+# Stages of the main loop, in the order they are run on each frame
+# Frames converted with --yuv are single channel YUV420 (I420) images
+STAGES = [
+	("readFrame", lambda fb, frame: fb.readFrame(frame, fb.startClock + fb.numFrames / FRAMERATE, "yuv" if frame.ndim == 2 else "bgr")),
+	("findTable", lambda fb, frame: fb.findTable()),
+	("findGoal", lambda fb, frame: fb.findGoal()),
+	("findBall", lambda fb, frame: fb.findBall()),
+	("trackPlayers", lambda fb, frame: fb.trackPlayers("BLUE")),
+	("buildOutputFrame", lambda fb, frame: fb.releaseOutputFrame(fb.buildOutputFrame())),
+]
+
+
+# Get the current git commit, so results can be compared across commits
+def gitCommit():
+	try:
+		root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+		return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=root, stderr=subprocess.DEVNULL).decode().strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+# Summarize a list of timings (in seconds) as milliseconds
+def summarize(timings):
+	ms = np.array(timings) * 1000
+	return {
+		"mean": float(ms.mean()),
+		"p50": float(np.percentile(ms, 50)),
+		"p95": float(np.percentile(ms, 95)),
+		"p99": float(np.percentile(ms, 99)),
+		"max": float(ms.max()),
+	}
+
+
+# Run every recorded frame through the pipeline and time each stage
+# If `render` is False, nothing is drawn and no output frame is built, like `main.py --nopreview` without `--output`
+def run(frames, repeat, warmup, stages=STAGES, render=True):
+	fb = Foosball(False).start()
+	fb.render = render
+	if not render:
+		stages = [(name, fn) for name, fn in stages if name != "buildOutputFrame"]
+	timings = {name: [] for name, fn in stages}
+	frameTimings = []
+
+	# Warm up caches and lazy initialization before timing
+	for frame in frames[:warmup]:
+		for name, fn in stages:
+			fn(fb, frame)
+		fb.msgs = []
+
+	start = time.perf_counter()
+	for i in range(repeat):
+		for frame in frames:
+			frameStart = time.perf_counter()
+			for name, fn in stages:
+				stageStart = time.perf_counter()
+				fn(fb, frame)
+				timings[name].append(time.perf_counter() - stageStart)
+			frameTimings.append(time.perf_counter() - frameStart)
+
+			# Log messages are normally flushed to the console each frame, drop them instead
+			fb.msgs = []
+	elapsed = time.perf_counter() - start
+
+	return {
+		"frames": len(frameTimings),
+		"elapsed": elapsed,
+		"fps": len(frameTimings) / elapsed,
+		"frame": summarize(frameTimings),
+		"stages": {name: summarize(timings[name]) for name, fn in stages},
+		"aruco": fb.getArucoStats(),
+	}
+
+
+# Print results as a table, with the change from a previous run if available
+def report(results, previous=None):
+	print("{:<18} {:>9} {:>9} {:>9} {:>9}".format("Stage", "p50 ms", "p95 ms", "p99 ms", "mean ms"))
+	rows = list(results["stages"].items()) + [("total", results["frame"])]
+	for name, s in rows:
+		line = "{:<18} {:9.3f} {:9.3f} {:9.3f} {:9.3f}".format(name, s["p50"], s["p95"], s["p99"], s["mean"])
+		if previous is not None:
+			p = previous["frame"] if name == "total" else previous["stages"].get(name)
+			if p is not None and p["p50"] > 0:
+				line += "  ({:+.1f}% p50)".format(100 * (s["p50"] - p["p50"]) / p["p50"])
+		print(line)
+	print()
+	print("Frames: {}  Elapsed: {:.2f} s  Throughput: {:.1f} FPS".format(results["frames"], results["elapsed"], results["fps"]))
+	aruco = results["aruco"]
+	print("ArUco detection: {:.1f}% of frames ({} full, {} nearby, {} moved), saved {:.3f} ms/frame".format(
+		100 * aruco["detectionRate"], aruco["fullDetections"], aruco["roiDetections"], aruco["moved"], aruco["savedMsPerFrame"]))
+	if previous is not None:
+		print("Previous throughput: {:.1f} FPS (commit {})".format(previous["fps"], previous.get("commit")))
+
+
+if __name__ == "__main__":
+
+	# construct the argument parser and parse the arguments
+	ap = argparse.ArgumentParser()
+	ap.add_argument("-i", "--input", required=True, help="path to recorded video file or directory of PNG images")
+	ap.add_argument("-r", "--repeat", type=int, default=3, help="number of passes over the recorded frames")
+	ap.add_argument("-w", "--warmup", type=int, default=5, help="number of frames to run before timing")
+	ap.add_argument("-j", "--json", help="path to write results as JSON")
+	ap.add_argument("-c", "--compare", help="path to previous JSON results to compare against")
+	ap.add_argument("-y", "--yuv", help="whether or not to convert frames to YUV420, like `main.py --yuv` captures them", action="store_true")
+	ap.add_argument("-n", "--norender", help="whether or not to skip drawing and building output frames, like `main.py --nopreview`", action="store_true")
+	args = vars(ap.parse_args())
+
+	# Load the whole corpus into memory so decoding is not part of the timing
+	vs = replayStream(args["input"], realtime=False, preload=True).start()
+	frames = list(vs.frames)
+	vs.stop()
+	if args["yuv"]:
+		frames = [cv2.cvtColor(frame, cv2.COLOR_BGR2YUV_I420) for frame in frames]
+
+	results = run(frames, args["repeat"], args["warmup"], render=not args["norender"])
+	results["input"] = args["input"]
+	results["format"] = "yuv" if args["yuv"] else "bgr"
+	results["render"] = not args["norender"]
+	results["commit"] = gitCommit()
+	results["timestamp"] = datetime.datetime.now().isoformat()
+	results["platform"] = platform.platform()
+	results["opencv"] = cv2.__version__
+
+	previous = None
+	if args["compare"]:
+		with open(args["compare"]) as f:
+			previous = json.load(f)
+
+	report(results, previous)
+
+	if args["json"]:
+		with open(args["json"], "w") as f:
+			json.dump(results, f, indent=2)
+		print("Results written to {}".format(args["json"]))
@@ -0,0 +1,102 @@
+############################
+# Benchmark Blob Detection #
+############################
+
+# This script is used to compare the blob detection backends (the `blobDetector` setting):
+# cv2.findContours with per-contour bounding rectangles and moments ("contours"),
+# vs cv2.connectedComponentsWithStats with filtering as array operations ("components")
+# Both backends run on the same recorded frames, and their results are compared
+
+# USAGE:
+# python3 benchmarkBlobs.py --input output.avi
+# python3 benchmarkBlobs.py --input output.avi --repeat 5
+
+# Import packages
+import argparse
+import cv2
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from foosball import Foosball
+
+# construct the argument parser and parse the arguments
+ap = argparse.ArgumentParser()
+ap.add_argument("-i", "--input", required=True, help="path to recorded video file")
+ap.add_argument("-r", "--repeat", type=int, default=3, help="number of passes over the recorded frames")
+args = vars(ap.parse_args())
+
+BACKENDS = ["contours", "components"]
+
+# Load recorded frames into memory so file decoding is not part of the timing
+frames = []
+cap = cv2.VideoCapture(args["input"])
+while True:
+	ok, frame = cap.read()
+	if not ok:
+		break
+	frames.append(frame)
+cap.release()
+if len(frames) == 0:
+	print("No frames found in {}".format(args["input"]))
+	sys.exit(1)
+
+# One instance per backend, so tracking state is not shared
+# The foosball is searched for in the whole frame at full resolution, so every frame does the same work
+detectors = {}
+for backend in BACKENDS:
+	fb = Foosball(False).start()
+	fb.vars["blobDetector"] = backend
+	fb.vars["ballTracking"] = False
+	fb.vars["ballPyramidLevels"] = 0
+	detectors[backend] = fb
+
+# Time the detectors on each frame, after the (shared) table warp and color labels
+# Also time blob detection alone, on the masks the detectors use
+detectTime = {backend: 0 for backend in BACKENDS}
+blobTime = {backend: 0 for backend in BACKENDS}
+results = {backend: [] for backend in BACKENDS}
+for r in range(args["repeat"]):
+	for i, frame in enumerate(frames):
+		for backend in BACKENDS:
+			fb = detectors[backend]
+			fb.readFrame(frame, i / 30.0)
+			fb.findTable()
+			fb._preprocess()
+
+			start = time.perf_counter()
+			fb.findBall()
+			fb.findAllPlayers("BLUE")
+			detectTime[backend] += time.perf_counter() - start
+			fb.msgs = []
+
+			masks = []
+			for color, iterations in [("ball", 2), ("RED", 4), ("BLUE", 4)]:
+				mask = fb._getColorMask(color)
+				mask = cv2.erode(mask, None, iterations=iterations)
+				masks.append(cv2.dilate(mask, None, iterations=iterations))
+			start = time.perf_counter()
+			for mask in masks:
+				fb._getBlobs(mask)
+			blobTime[backend] += time.perf_counter() - start
+
+			if r == 0:
+				results[backend].append((fb.foosballPosition, [list(p) for p in fb.playerPositions]))
+
+numFrames = args["repeat"] * len(frames)
+print("{:<12} {:>16} {:>16}".format("Backend", "detect ms/frame", "blobs ms/frame"))
+for backend in BACKENDS:
+	print("{:<12} {:16.3f} {:16.3f}".format(backend, 1000 * detectTime[backend] / numFrames, 1000 * blobTime[backend] / numFrames))
+print()
+
+# Foosball centroids are computed from the contour polygon or from the pixels, so they can differ slightly
+ballDiff = 0
+playerMismatches = 0
+for a, b in zip(results["contours"], results["components"]):
+	if a[0] is not None and b[0] is not None:
+		ballDiff = max(ballDiff, abs(a[0][0] - b[0][0]), abs(a[0][1] - b[0][1]))
+	if a[1] != b[1]:
+		playerMismatches += 1
+print("Largest foosball position difference: {} px".format(ballDiff))
+print("Frames with different players detected: {} of {}".format(playerMismatches, len(frames)))
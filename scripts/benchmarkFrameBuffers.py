@@ -0,0 +1,119 @@
+###########################
+# Benchmark Frame Buffers #
+###########################
+
+# This script is used to measure how much memory is allocated, and how often the
+# garbage collector runs, while reading frames and running the detectors on them
+# Run it before and after a change to see whether frames are being copied or reallocated
+
+# Allocations are traced with tracemalloc, which also sees numpy and OpenCV image buffers.
+# For each step, the peak traced memory above what was in use when the step started is counted.
+# That is a lower bound on what the step allocates: buffers freed before the next one is allocated
+# are only counted once.
+
+# USAGE:
+# python3 benchmarkFrameBuffers.py --input output.avi
+# python3 benchmarkFrameBuffers.py --input output.avi --frames 600
+
+# Import packages
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from foosball import Foosball
+from replay import replayStream
+
+# construct the argument parser and parse the arguments
+ap = argparse.ArgumentParser()
+ap.add_argument("-i", "--input", required=True, help="path to recorded video file or directory of PNG images")
+ap.add_argument("-n", "--frames", type=int, default=300, help="number of frames to process (the recording is looped)")
+ap.add_argument("-w", "--warmup", type=int, default=10, help="number of frames to run before measuring")
+args = vars(ap.parse_args())
+
+
+# Steps of the vision loop, in the order they are run on each frame
+# The first step reads the next frame from the recording, and the rest run on it
+STEPS = [
+	("read", None),
+	("readFrame", lambda fb, frame, timestamp: fb.readFrame(frame, timestamp)),
+	("findTable", lambda fb, frame, timestamp: fb.findTable()),
+	("findGoal", lambda fb, frame, timestamp: fb.findGoal()),
+	("findBall", lambda fb, frame, timestamp: fb.findBall()),
+	("trackPlayers", lambda fb, frame, timestamp: fb.trackPlayers("BLUE")),
+]
+
+
+# Count garbage collections of each generation, and the time spent in them
+class gcMonitor:
+
+	def __init__(self):
+		self.collections = [0, 0, 0]
+		self.time = 0
+		self.startTime = None
+
+	def callback(self, phase, info):
+		if phase == "start":
+			self.startTime = time.perf_counter()
+		else:
+			self.collections[info["generation"]] += 1
+			self.time += time.perf_counter() - self.startTime
+
+
+# Run the vision loop over `numFrames` frames, calling `measure(name, fn)` for each step
+def run(vs, fb, numFrames, measure):
+	for i in range(numFrames):
+		frame, seq, timestamp = measure("read", lambda: vs.read())
+		if frame is None:
+			break
+		for name, fn in STEPS[1:]:
+			measure(name, lambda: fn(fb, frame, timestamp))
+		fb.msgs = []
+
+
+vs = replayStream(args["input"], realtime=False, loop=True).start()
+fb = Foosball(False).start()
+run(vs, fb, args["warmup"], lambda name, fn: fn())
+
+# Time each frame, and count garbage collections, without tracing allocations
+monitor = gcMonitor()
+gc.callbacks.append(monitor.callback)
+start = time.perf_counter()
+run(vs, fb, args["frames"], lambda name, fn: fn())
+elapsed = time.perf_counter() - start
+gc.callbacks.remove(monitor.callback)
+
+# Trace allocations of each step
+allocated = {name: 0 for name, fn in STEPS}
+tracemalloc.start()
+
+
+def traced(name, fn):
+	tracemalloc.reset_peak()
+	before = tracemalloc.get_traced_memory()[0]
+	result = fn()
+	allocated[name] += tracemalloc.get_traced_memory()[1] - before
+	return result
+
+
+startMemory = tracemalloc.get_traced_memory()[0]
+run(vs, fb, args["frames"], traced)
+retained = tracemalloc.get_traced_memory()[0] - startMemory
+tracemalloc.stop()
+vs.stop()
+
+numFrames = args["frames"]
+print("{:<18} {:>12}".format("Step", "KB/frame"))
+for name, fn in STEPS:
+	print("{:<18} {:12.1f}".format(name, allocated[name] / numFrames / 1024))
+total = sum(allocated.values())
+print("{:<18} {:12.1f}".format("total", total / numFrames / 1024))
+print()
+print("Allocated: {:.2f} MB/frame, {:.1f} MB/s at 30 FPS".format(total / numFrames / 1048576, 30 * total / numFrames / 1048576))
+print("Retained after {} frames: {:.1f} KB".format(numFrames, retained / 1024))
+print("Time: {:.3f} ms/frame".format(1000 * elapsed / numFrames))
+print("GC collections per 1000 frames: gen0 {:.1f}, gen1 {:.1f}, gen2 {:.1f} ({:.3f} ms in GC per 1000 frames)".format(
+	*[1000 * c / numFrames for c in monitor.collections], 1e6 * monitor.time / numFrames))
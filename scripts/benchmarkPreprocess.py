@@ -0,0 +1,84 @@
+###########################
+# Benchmark Preprocessing #
+###########################
+
+# This script is used to compare the per-frame cost of blurring and converting
+# each warped frame to HSV once per detector vs once per frame (shared),
+# and of color masks from HSV ranges vs from a color lookup table
+
+# USAGE:
+# python3 benchmarkPreprocess.py --input output.avi
+# python3 benchmarkPreprocess.py --input output.avi --repeat 5
+
+# Import packages
+import argparse
+import cv2
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from foosball import Foosball
+
+# construct the argument parser and parse the arguments
+ap = argparse.ArgumentParser()
+ap.add_argument("-i", "--input", required=True, help="path to recorded video file")
+ap.add_argument("-r", "--repeat", type=int, default=3, help="number of passes over the recorded frames")
+args = vars(ap.parse_args())
+
+# Load recorded frames into memory so file decoding is not part of the timing
+frames = []
+cap = cv2.VideoCapture(args["input"])
+while True:
+	ok, frame = cap.read()
+	if not ok:
+		break
+	frames.append(frame)
+cap.release()
+if len(frames) == 0:
+	print("No frames found in {}".format(args["input"]))
+	sys.exit(1)
+
+# Warp every frame to the table once, so only preprocessing is timed below
+# findTable() reuses the same output buffer on every frame, so keep a copy of each
+fb = Foosball(False).start()
+tableFrames = []
+for frame in frames:
+	fb.readFrame(frame)
+	tableFrames.append(fb.findTable().copy())
+
+
+# Previous behavior: findBall() and findPlayers() x2 each copy, blur, and convert the frame
+def separate(frame):
+	for i in range(3):
+		origImg = frame.copy()
+		blurred = cv2.GaussianBlur(origImg, (11, 11), 0)
+		hsv = cv2.cvtColor(blurred, cv2.COLOR_BGR2HSV)
+
+
+# Shared: all three detectors share one cached HSV image per frame, and each checks its HSV ranges
+def shared(frame):
+	fb.vars["colorLUT"] = False
+	fb.frame = frame
+	fb.numFrames += 1
+	for color in ["ball", "RED", "BLUE"]:
+		mask = fb._getColorMask(color)
+
+
+# Lookup: all three detectors share one cached image of color labels per frame, from a lookup table
+def lookup(frame):
+	fb.vars["colorLUT"] = True
+	fb.frame = frame
+	fb.numFrames += 1
+	for color in ["ball", "RED", "BLUE"]:
+		mask = fb._getColorMask(color)
+
+
+for name, fn in [("separate", separate), ("shared", shared), ("lookup", lookup)]:
+	start = time.perf_counter()
+	for i in range(args["repeat"]):
+		for frame in tableFrames:
+			fn(frame)
+	elapsed = time.perf_counter() - start
+	numFrames = args["repeat"] * len(tableFrames)
+	print("{:>8}: {:7.3f} ms/frame over {} frames".format(name, 1000 * elapsed / numFrames, numFrames))
@@ -0,0 +1,230 @@
+###########################
+# Test pigpio Pulses      #
+###########################
+
+# This script is used to test pigpio waveform step pulses without a Raspberry Pi
+# A local stand-in for the pigpio module records every waveform that would be sent to the
+# pigpio daemon, so we can verify the pulse trains and their timing for moves and kicks
+
+# USAGE:
+# python3 testPigpioPulses.py
+
+# Import packages
+import os
+import sys
+import threading
+import time
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+
+# Stand-in for pigpio.pi, which records waveforms instead of sending them to the daemon
+# Waveforms sent with wave_send_using_mode() are "played" one after the other in real time,
+# like pigpio does with WAVE_MODE_ONE_SHOT_SYNC, so the transmit thread sees the same timing
+class FakePi:
+
+	def __init__(self, host="localhost", port=8888):
+		self.connected = True
+		self.pending = []
+		self.waves = {}
+		self.nextWaveId = 0
+		self.sent = []
+		self.playing = []
+		self.pins = {}
+		self.lock = threading.Lock()
+
+	def set_mode(self, pin, mode):
+		self.pins[pin] = 0
+
+	def write(self, pin, value):
+		self.pins[pin] = value
+
+	def wave_clear(self):
+		self.pending = []
+		self.waves = {}
+
+	def wave_add_generic(self, pulses):
+		self.pending.extend(pulses)
+		return len(self.pending)
+
+	def wave_create(self):
+		waveId = self.nextWaveId
+		self.nextWaveId += 1
+		self.waves[waveId] = self.pending
+		self.pending = []
+		return waveId
+
+	def wave_send_using_mode(self, waveId, mode):
+		assert mode == pigpio.WAVE_MODE_ONE_SHOT_SYNC, "waveforms should be queued after the one playing"
+		with self.lock:
+			now = time.perf_counter()
+			start = max([now] + [end for w, s, end in self.playing])
+			end = start + sum(p.delay for p in self.waves[waveId]) / 1000000
+			self.playing.append((waveId, start, end))
+			self.sent.append(self.waves[waveId])
+
+	def wave_tx_at(self):
+		now = time.perf_counter()
+		with self.lock:
+			for waveId, start, end in self.playing:
+				if start <= now < end:
+					return waveId
+		return 9999
+
+	def wave_tx_busy(self):
+		return 1 if self.wave_tx_at() != 9999 else 0
+
+	def wave_tx_stop(self):
+		pass
+
+	def wave_delete(self, waveId):
+		assert waveId != self.wave_tx_at(), "wave {} deleted while playing".format(waveId)
+		del self.waves[waveId]
+
+	def stop(self):
+		self.connected = False
+
+
+# Stand-in for pigpio.pulse
+class FakePulse:
+
+	def __init__(self, gpio_on, gpio_off, delay):
+		self.gpio_on = gpio_on
+		self.gpio_off = gpio_off
+		self.delay = delay
+
+
+# Install stand-in pigpio module before importing anything that uses it
+pigpio = types.ModuleType("pigpio")
+pigpio.pi = FakePi
+pigpio.pulse = FakePulse
+pigpio.OUTPUT = 1
+pigpio.WAVE_MODE_ONE_SHOT_SYNC = 3
+sys.modules["pigpio"] = pigpio
+
+from foosmen import Foosmen
+from pulses import PigpioPulses
+
+
+# Get every pulse sent since `mark` (the number of waveforms sent before), as one waveform
+# Each move starts at the beginning of a tick, and every tick's waveform is sent while it is moving,
+# so this is the move's own timeline
+def sentSince(mark):
+	return [p for wave in pi.sent[mark:] for p in wave]
+
+
+# Replay a recorded waveform and return the (start, end) time in microseconds of each pulse on a pin
+def pulseTimes(pulses, pin):
+	times = []
+	t = 0
+	start = None
+	for p in pulses:
+		if p.gpio_on & (1 << pin):
+			start = t
+		if p.gpio_off & (1 << pin):
+			times.append((start, t))
+		t += p.delay
+	return times
+
+
+# Check that each pulse on a pin starts at the expected time and is high for its delay
+# By default pulses are back to back, so each one is low for its delay before the next one starts
+# Waveforms are timed in whole microseconds, so allow 1us of rounding
+def checkTimes(name, times, delays, starts=None):
+	assert len(times) == len(delays), "{}: expected {} pulses, got {}".format(name, len(delays), len(times))
+	t = 0
+	for i, (start, end) in enumerate(times):
+		us = delays[i] * 1000000
+		expected = starts[i] * 1000000 if starts is not None else t
+		assert abs(end - start - us) <= 1, "{}: pulse {} is high for {} us, expected {:.0f} us".format(name, i, end - start, us)
+		assert abs(start - expected) <= 1, "{}: pulse {} starts at {} us, expected {:.0f} us".format(name, i, start, expected)
+		t += 2 * us
+	print("PASS {}: {} pulses in {:.1f} ms".format(name, len(delays), (times[-1][1] if times else 0) / 1000))
+
+
+pulses = PigpioPulses()
+row = Foosmen(3, 5, 280, 68.45, 58.18, (5, 6, 13), (17, 27, 22), pulses).start()
+pi = pulses.pi
+
+# Every waveform is exactly one tick long
+mark = len(pi.sent)
+row.kick()
+ticks = set(sum(p.delay for p in wave) for wave in pi.sent[mark:])
+assert ticks == {int(round(pulses.tick * 1000000))}, "waveforms should all be one tick long, got {}".format(ticks)
+
+# Kick sends one revolution on the rotational PUL pin
+checkTimes("kick", pulseTimes(sentSince(mark), 17), row.rotationalProfile.getDelays(row.stepsPerRevolution))
+
+# Move sends one pulse per step on the linear PUL pin, and updates position
+mark = len(pi.sent)
+row.moveTo(40)
+checkTimes("moveTo", pulseTimes(sentSince(mark), 5), row.linearProfile.getDelays(40))
+assert row.position == 40, "moveTo: position is {}, expected 40".format(row.position)
+assert pi.pins[6] == 1, "moveTo: direction pin should be forward"
+
+# Moving backward sets direction pin low
+mark = len(pi.sent)
+row.moveTo(10)
+checkTimes("moveTo backward", pulseTimes(sentSince(mark), 5), row.linearProfile.getDelays(30))
+assert row.position == 10, "moveTo backward: position is {}, expected 10".format(row.position)
+assert pi.pins[6] == 0, "moveTo backward: direction pin should be backward"
+
+# Two pins on the same timeline are merged into one waveform
+mark = len(pi.sent)
+pulses.pulse([(5, [0.001] * 10), (17, [0.002] * 5)])
+checkTimes("merged linear", pulseTimes(sentSince(mark), 5), [0.001] * 10)
+checkTimes("merged rotational", pulseTimes(sentSince(mark), 17), [0.002] * 5)
+
+# Moving while kicking sends both motors on one timeline, starting and finishing together
+row.position = 0
+mark = len(pi.sent)
+row.moveAndKick(50)
+linear, rotational = row._planCoordinatedMove(50, row.stepsPerRevolution)
+linearTimes = pulseTimes(sentSince(mark), 5)
+rotationalTimes = pulseTimes(sentSince(mark), 17)
+checkTimes("moveAndKick linear", linearTimes, linear[0], linear[1])
+checkTimes("moveAndKick rotational", rotationalTimes, rotational[0], rotational[1])
+assert row.position == 50, "moveAndKick: position is {}, expected 50".format(row.position)
+assert rotationalTimes[-1][1] - linearTimes[-1][1] < 2 * 1000000 * row.delay * (row.stepsPerRevolution / 50), "moveAndKick: motors should finish together"
+gaps = [b[0] - a[0] for a, b in zip(linearTimes, linearTimes[1:])]
+assert max(gaps) < 5 * min(gaps), "moveAndKick: linear steps should be spread evenly"
+
+# Neither motor of a coordinated move goes faster than its own profile allows, even when the other one sets the pace
+for linearSteps in range(10, row.stepsPerRevolution + 1, 10):
+	for steps, profile in zip((linearSteps, row.stepsPerRevolution), (row.linearProfile, row.rotationalProfile)):
+		plan = row._planCoordinatedMove(linearSteps, row.stepsPerRevolution)[0 if profile is row.linearProfile else 1]
+		minGap = min(b - a for a, b in zip(plan[1], plan[1][1:]))
+		assert minGap >= 1 / profile.maxSpeed - 1e-9, "moveAndKick {} steps: pulses {:.3f} ms apart, above the maximum speed".format(linearSteps, 1000 * minGap)
+mark = len(pi.sent)
+row.moveAndKick(row.position + 190)
+gaps = [b[0] - a[0] for a, b in zip(pulseTimes(sentSince(mark), 5), pulseTimes(sentSince(mark), 5)[1:])]
+assert min(gaps) >= 1000000 / row.linearProfile.maxSpeed - 2, "moveAndKick: linear pulses {} us apart, above the maximum speed".format(min(gaps))
+print("PASS moveAndKick speed: linear pulses at least {:.2f} ms apart".format(min(gaps) / 1000))
+
+# Two rows pulse at the same time: a move on another row does not wait for this row's kick to finish
+other = Foosmen(5, 3, 443, 97.54, 116.37, (19, 26, 21), None, pulses).start()
+mark = len(pi.sent)
+start = time.perf_counter()
+kick = threading.Thread(target=row.kick)
+kick.start()
+time.sleep(2 * pulses.tick)
+other.moveTo(60)
+moveTime = time.perf_counter() - start
+kick.join()
+kickTimes = pulseTimes(sentSince(mark), 17)
+moveTimes = pulseTimes(sentSince(mark), 19)
+checkTimes("concurrent kick", kickTimes, row.rotationalProfile.getDelays(row.stepsPerRevolution))
+assert len(moveTimes) == 60 and other.position == 60, "concurrent moveTo: sent {} pulses, position is {}".format(len(moveTimes), other.position)
+assert moveTimes[0][0] < kickTimes[-1][0] and moveTimes[-1][1] < kickTimes[-1][1], "concurrent moveTo: should be sent while the kick is playing"
+assert moveTime < row.rotationalProfile.getDuration(row.stepsPerRevolution), "concurrent moveTo: should not wait for the kick to finish"
+print("PASS concurrent rows: moveTo finished after {:.1f} ms, during a {:.1f} ms kick".format(1000 * moveTime, kickTimes[-1][1] / 1000))
+
+# Accelerating moves start and end at the starting speed, and are faster in the middle
+delays = row.linearProfile.getDelays(100)
+assert abs(delays[0] - row.delay) < 1e-5 and abs(delays[-1] - row.delay) < 1e-5, "profile: should start and stop at `delay`"
+assert delays.min() < row.delay, "profile: should accelerate above the starting speed"
+print("PASS profile: {:.1f} ms to move 100 steps, {:.1f} ms at constant speed".format(1000 * row.linearProfile.getDuration(100), 1000 * 200 * row.delay))
+
+pulses.cleanup()
+print("All pigpio pulse tests passed")
@@ -79,6 +79,10 @@ sudo apt install -y i2c-tools python3-smbus
 # Install CircuitPython helper library for DC and Stepper Motors
 pip3 install --upgrade adafruit-circuitpython-motorkit
 
+# Install pigpio for hardware-timed stepper pulses (python main.py --pigpio)
+sudo apt install -y pigpio python3-pigpio
+sudo systemctl enable pigpiod
+
 
 #########################
 # FINISH SETUP          #
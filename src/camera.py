@@ -3,27 +3,71 @@
 #########################
 
 # import the necessary packages
-from picamera.array import PiRGBArray
 from picamera import PiCamera
 from threading import Thread
+from framering import FrameRing
+import numpy as np
+import time
+
+
+# picamera writes each captured frame to this object in one or more chunks
+# The data is written straight into a buffer from the frame ring, instead of a new array for every frame
+class frameOutput:
+
+    # Initialize
+    def __init__(self, ring):
+        self.ring = ring
+        self.offset = 0
+        self.timestamp = None
+
+
+    # Copy the next chunk of the frame into the ring buffer being filled
+    def write(self, data):
+        if self.offset == 0:
+            self.timestamp = time.perf_counter()
+        buffer = self.ring.getBuffer().reshape(-1)
+        n = min(len(data), len(buffer) - self.offset)
+        buffer[self.offset:self.offset + n] = np.frombuffer(data, dtype="uint8", count=n)
+        self.offset += n
+        return len(data)
+
+
+    # Publish the frame once it has been fully written, and start on the next one
+    def publish(self, seq):
+        self.ring.publish(seq, self.timestamp)
+        self.offset = 0
 
 
 class videoStream:
 
     # Initialize
-    def __init__(self, resolution=(640, 480), framerate=32):
+    # Frames are captured into a ring of `buffers` preallocated frames (see FrameRing)
+    # `format` is "bgr", or "yuv" to capture raw YUV420 (I420) frames: a full-size grayscale Y plane followed by
+    # quarter-size U and V planes, in a single (height * 3/2, width) array. This is half the size of a BGR frame, and
+    # leaves color conversion to Foosball, which only converts the table. The resolution must be a multiple of 32x16,
+    # or picamera pads each plane.
+    def __init__(self, resolution=(640, 480), framerate=32, buffers=5, format="bgr"):
 
         self.camera = PiCamera()
         self.camera.resolution = resolution
         self.camera.framerate = framerate
-        self.rawCapture = PiRGBArray(self.camera, size=resolution)
-        self.stream = self.camera.capture_continuous(self.rawCapture, format="bgr", use_video_port=True)
+        self.format = format
+        if format == "yuv":
+            shape = (resolution[1] * 3 // 2, resolution[0])
+        else:
+            shape = (resolution[1], resolution[0], 3)
+        self.ring = FrameRing(shape, buffers)
+        self.output = frameOutput(self.ring)
+        self.stream = self.camera.capture_continuous(self.output, format=format, use_video_port=True)
 
         # initialize the frame and the variable used to indicate
         # if the thread should be stopped
         self.frame = None
         self.stopped = False
 
+        # Each frame is numbered, and stamped with time.perf_counter() as soon as it starts arriving
+        self.seq = 0
+
 
     # Start stream
     def start(self):
@@ -37,25 +81,44 @@ class videoStream:
     def update(self):
         # keep looping infinitely until the thread is stopped
         for f in self.stream:
-            # grab the frame from the stream and clear the stream in
-            # preparation for the next frame
-            self.frame = f.array
-            self.rawCapture.truncate(0)
+            # hand the frame over to the consumer and fill the next buffer
+            self.seq += 1
+            self.output.publish(self.seq)
 
             # if the thread indicator variable is set, stop the thread
             # and resource camera resources
             if self.stopped:
                 self.stream.close()
-                self.rawCapture.close()
                 self.camera.close()
                 return
 
 
-    # Return the frame most recently used
-    def read(self):
-        return self.frame
+    # Return the newest captured frame, its sequence number, and its capture timestamp
+    # Sequence numbers start at 1 and increase by one for every captured frame, so a gap means frames were skipped
+    # If `wait` is True, block until a new frame is available, or until `timeout` (in seconds)
+    # The frame is None if no new frame was captured since the last read() (or the stream stopped)
+    # The frame is not copied: it belongs to the caller until the next read(), or if `hold` is True,
+    # until it is passed to release(). Only hold as many frames as the ring has buffers to spare.
+    def read(self, wait=False, timeout=None, hold=False):
+        if self.frame is not None:
+            self.ring.release(self.frame)
+            self.frame = None
+
+        taken = self.ring.take(wait, timeout)
+        if taken is None:
+            return None, self.seq, None
+        frame, seq, timestamp = taken
+        if not hold:
+            self.frame = frame
+        return frame, seq, timestamp
+
+
+    # Give a frame read with `hold` back to the ring
+    def release(self, frame):
+        self.ring.release(frame)
 
 
     def stop(self):
         # indicate that the thread should be stopped
         self.stopped = True
+        self.ring.close()
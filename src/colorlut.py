@@ -0,0 +1,129 @@
+#########################
+# Automated Foosball    #
+#########################
+
+# This class labels every pixel of a BGR image with its color class (ie foosball, RED foosmen, BLUE foosmen)
+# using a single table lookup, instead of converting to HSV and checking each HSV range with cv2.inRange().
+#
+# The table has one entry per 16-bit BGR565 color: 32 levels of blue, 64 of green, and 32 of red.
+# This makes each pixel's index a single cv2.cvtColor(BGR2BGR565), and the table (64 KB) small enough to stay in cache.
+# Each entry is a set of bit flags, one per class, so a color can belong to more than one class if HSV ranges overlap.
+# A color is in a class if most of the 24-bit colors it stands for are within one of the class's HSV ranges.
+#
+# Building the table takes a few hundred milliseconds, so it is saved to `cacheDir`, named after a hash of
+# the HSV ranges. It only needs to be rebuilt when the HSV ranges change.
+
+# import the necessary packages
+import cv2
+import hashlib
+import json
+import os
+import numpy as np
+
+
+class ColorLUT:
+
+    # Version of the table layout, which is part of the cache file name
+    version = 1
+
+    # Initialize table
+    # `ranges` is a dictionary of class name: list of (lower, upper) HSV ranges
+    # Classes are given bit flags in sorted name order (see getLabel())
+    def __init__(self, ranges, cacheDir=None):
+
+        self.ranges = {name: [(tuple(lower), tuple(upper)) for lower, upper in ranges[name]] for name in ranges}
+        self.names = sorted(self.ranges)
+        if len(self.names) > 8:
+            raise ValueError("ColorLUT supports at most 8 color classes")
+        self.labels = {name: 1 << i for i, name in enumerate(self.names)}
+
+        self.table = None
+        self.cachePath = None
+        if cacheDir is not None:
+            self.cachePath = os.path.join(cacheDir, "colorlut-{}.npy".format(self.getKey()))
+
+        # Scratch buffers for BGR565 colors, and the same colors as table indexes,
+        # reused for every image no larger than the largest one so far
+        self.codes = np.empty(0, dtype="uint8")
+        self.indexes = np.empty(0, dtype="intp")
+
+
+    # Get a hash of the HSV ranges, so that tables built from different ranges are cached separately
+    def getKey(self):
+        key = json.dumps({"version": self.version, "ranges": [[name, self.ranges[name]] for name in self.names]})
+        return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+    # Get the bit flag for a class
+    def getLabel(self, name):
+        return self.labels[name]
+
+
+    # Load the table from the cache, or build it (and save it to the cache)
+    # Returns True if the table was loaded from the cache
+    def load(self):
+        if self.cachePath is not None and os.path.exists(self.cachePath):
+            try:
+                table = np.load(self.cachePath)
+                if table.shape == (65536,) and table.dtype == np.uint8:
+                    self.table = table
+                    return True
+            except (OSError, ValueError):
+                pass
+
+        self.table = self.build()
+
+        if self.cachePath is not None:
+            try:
+                os.makedirs(os.path.dirname(self.cachePath), exist_ok=True)
+                np.save(self.cachePath, self.table)
+            except OSError:
+                pass
+        return False
+
+
+    # Build the table
+    # Every BGR565 color stands for 8 x 4 x 8 24-bit colors, which are each converted to HSV and checked against
+    # every range. The colors are processed one offset within the block at a time, to keep memory use small.
+    def build(self):
+        codes = np.arange(65536, dtype="uint16").view("uint8").reshape(256, 256, 2)
+        base = cv2.cvtColor(codes, cv2.COLOR_BGR5652BGR).astype("int16")
+
+        counts = {name: np.zeros((256, 256), dtype="uint16") for name in self.names}
+        colors = np.empty((256, 256, 3), dtype="uint8")
+        for b in range(8):
+            for g in range(4):
+                for r in range(8):
+                    np.add(base, (b, g, r), out=colors, casting="unsafe")
+                    hsv = cv2.cvtColor(colors, cv2.COLOR_BGR2HSV)
+                    for name in self.names:
+                        mask = None
+                        for lower, upper in self.ranges[name]:
+                            inRange = cv2.inRange(hsv, lower, upper)
+                            mask = inRange if mask is None else cv2.bitwise_or(mask, inRange)
+                        counts[name] += mask & 1
+
+        table = np.zeros((256, 256), dtype="uint8")
+        for name in self.names:
+            table[counts[name] > 8 * 4 * 8 // 2] |= self.labels[name]
+        return table.reshape(-1)
+
+
+    # Label every pixel of a BGR image
+    # Returns an image of bit flags, written to `out` if given
+    # np.take() would otherwise make a full size copy of the indexes (as intp), and of `out` (unless mode is "clip")
+    def label(self, bgr, out=None):
+        if self.table is None:
+            self.load()
+        shape = bgr.shape[:2]
+        size = shape[0] * shape[1]
+        if self.indexes.size < size:
+            self.codes = np.empty(size * 2, dtype="uint8")
+            self.indexes = np.empty(size, dtype="intp")
+        codes = self.codes[:size * 2].reshape(shape + (2,))
+        indexes = self.indexes[:size].reshape(shape)
+        cv2.cvtColor(bgr, cv2.COLOR_BGR2BGR565, dst=codes)
+        np.copyto(indexes, codes.view("uint16")[..., 0])
+        if out is None or out.shape != shape:
+            out = np.empty(shape, dtype="uint8")
+        return np.take(self.table, indexes, out=out, mode="clip")
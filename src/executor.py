@@ -0,0 +1,136 @@
+#########################
+# Automated Foosball    #
+#########################
+
+# This class sends commands to a row of foosmen on its own worker thread
+# Moving or kicking a row takes hundreds of motor steps, so commands are queued here
+# and the main loop can keep processing frames while the motors are moving.
+# A new moveTo() target replaces any stale target, and interrupts a move already in progress.
+
+# import the necessary packages
+from collections import deque
+from threading import Condition, Event, Thread
+
+
+class MotorExecutor:
+
+    # Initialize executor for a foosmen row
+    def __init__(self, row):
+
+        self.row = row
+
+        # Pending commands, and the command currently being executed
+        self.commands = deque()
+        self.current = None
+
+        # Set to interrupt a move in progress when a newer target arrives
+        self.preempt = Event()
+
+        self.condition = Condition()
+        self.stopped = False
+        self.thread = None
+
+
+    # Start worker thread
+    def start(self):
+        self.thread = Thread(target=self.update, args=())
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+
+    # Execute commands in order until stopped
+    def update(self):
+        while True:
+            with self.condition:
+                while len(self.commands) == 0 and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                command, args = self.commands.popleft()
+                self.current = command
+                self.preempt.clear()
+
+            # A command that fails (ie the pulse generator stopped working) is reported, and the next one is still run
+            try:
+                if command == "moveTo":
+                    self.row.moveTo(*args, cancel=self.preempt)
+                elif command == "kick":
+                    self.row.kick(cancel=self.preempt)
+                elif command == "moveAndKick":
+                    self.row.moveAndKick(*args, cancel=self.preempt)
+            except Exception as e:
+                print("[ERROR] Row {} {} failed: {}".format(self.row.id, command, e))
+
+            with self.condition:
+                self.current = None
+                self.condition.notify_all()
+
+
+    # Queue a linear move to a specific position
+    # Any queued or in progress move is replaced, since its target is now stale
+    # A queued move is replaced where it is, so it still runs before any kick queued after it
+    def moveTo(self, pos):
+        with self.condition:
+            for i, (command, args) in enumerate(self.commands):
+                if command == "moveTo":
+                    self.commands[i] = ("moveTo", (pos,))
+                    break
+            else:
+                self.commands.append(("moveTo", (pos,)))
+            if self.current == "moveTo":
+                self.preempt.set()
+            self.condition.notify_all()
+
+
+    # Queue a move to the center position
+    def center(self):
+        self.moveTo(self.row.centerPosition)
+
+
+    # Queue a kick, unless one is already queued or in progress
+    def kick(self):
+        self._queueKick("kick", ())
+
+
+    # Queue a linear move to a specific position while kicking at the same time
+    # Like kick(), this is ignored if a kick is already queued or in progress
+    def moveAndKick(self, pos):
+        self._queueKick("moveAndKick", (pos,))
+
+
+    # Queue a kick command, unless any kick is already queued or in progress
+    def _queueKick(self, command, args):
+        kicks = ("kick", "moveAndKick")
+        with self.condition:
+            if self.current in kicks or any(c[0] in kicks for c in self.commands):
+                return
+            self.commands.append((command, args))
+            self.condition.notify_all()
+
+
+    # Return True if a command is queued or in progress
+    def isBusy(self):
+        with self.condition:
+            return self.current is not None or len(self.commands) > 0
+
+
+    # Block until all queued commands have finished, or until `timeout` (in seconds)
+    def wait(self, timeout=None):
+        with self.condition:
+            return self.condition.wait_for(lambda: self.current is None and len(self.commands) == 0, timeout)
+
+
+    # Stop worker thread, interrupting any move or kick in progress
+    # Waits up to `timeout` seconds for the command in progress to stop, so the motors can be released safely after
+    # Returns False if the worker thread is still running
+    def stop(self, timeout=1.0):
+        with self.condition:
+            self.stopped = True
+            self.commands.clear()
+            self.preempt.set()
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            return not self.thread.is_alive()
+        return True
@@ -8,18 +8,37 @@ import cv2.aruco as aruco
 import datetime
 import math
 import numpy as np
+import os
 import time
+import trajectory
+from threading import Lock
+from colorlut import ColorLUT
+from kalman import BallFilter
+from playertracker import PlayerTracker, TRACKED_DTYPE
+from renderer import OutputRenderer
+
+
+# Blobs found in a color mask (see Foosball._getBlobs): bounding rectangle, area (in pixels), and centroid
+BLOB_DTYPE = np.dtype([("x", "i4"), ("y", "i4"), ("w", "i4"), ("h", "i4"), ("area", "f4"), ("cx", "f4"), ("cy", "f4")])
+
+# Foosmen found by Foosball.findPlayers: rod (row), position (x of the rod, y of the center), and bounding rectangle (x, y, w, h)
+PLAYER_DTYPE = np.dtype([("row", "i4"), ("x", "i4"), ("y", "f4"), ("bbox", "i4", (4,))])
 
 
 class Foosball:
 
+    # Rows between the stacked color masks of both players (see _getPlayerMasks()), which is as far as erosions look
+    playerMaskGap = 4
+
     # Initialize table
     def __init__(self, debug=False):
 
         self.debug = debug
 
         # Track console log in buffer to save processing time
+        # Messages are logged from the vision and strategy threads, so the buffer is only changed with the lock held
         self.msgs = []
+        self.msgsLock = Lock()
 
         # Create a dictionary with pre-calculated values for faster lookup
         # Attributes prefixed with an underscore (_) are needed for calculation only
@@ -38,6 +57,19 @@ class Foosball:
             # Output coordinates of frame
             'outputCoords': [(0, 0), (639, 0), (639, 359), (0, 359)],
 
+            # The perspective transformation is only recomputed if a table corner moves
+            # by more than this many pixels, otherwise the cached transformation is reused
+            'tableCoordsTolerance': 1.5,            # Table corner tolerance (in pixels)
+
+            # ArUco markers are only detected every few frames, since the table rarely moves
+            # Markers are searched for within a margin around their last known position first
+            'arucoInterval': 10,                    # Number of frames between marker detection
+            'arucoSearchMargin': 24,                # Search margin around last known markers (in pixels)
+
+            # Offset between the top left corner of each ArUco marker and the corner of the table
+            # Markers are placed top left (0), top right (1), bottom right (2), and bottom left (3)
+            'arucoOffsets': {0: (22, 7), 1: (-24, 7), 2: (-26, 8), 3: (22, 7)},
+
             # Add additional spacing below picture for output display
             'outputWidth': 640,                     # Output width is the same as table width
             'outputHeight': 484,                    # Output height is 124px more than table height
@@ -62,6 +94,23 @@ class Foosball:
             'foosballHSVUpper': (26, 200, 200),     # Foosball upper bound (HSV)
             'foosballMaxPositions': 30,             # The maximum number of "coordinates" to track
 
+            # While the foosball is being tracked, only search a window around its projected position
+            # The window extends a number of foosball widths, plus a multiple of the current velocity (in pixels/frame)
+            'ballTracking': True,                   # Search around projected position instead of whole frame
+            'ballSearchMargin': 2,                  # Search window margin (in foosball widths)
+            'ballSearchVelocityScale': 2,           # Search window margin (multiple of velocity)
+
+            # Otherwise, candidates are found on a downscaled copy of the table frame, and the foosball is only
+            # located at full resolution in a small patch around the largest one. Each level halves the resolution.
+            'ballPyramidLevels': 1,                 # Coarse search levels (0 to search at full resolution)
+
+            # The foosball position and velocity are estimated with a Kalman filter
+            # Unmodeled acceleration (ie kicks and bounces) is treated as noise in the motion model
+            'ballFilterAcceleration': False,        # Use a constant acceleration model instead of constant velocity
+            'ballFilterProcessNoise': 1500.0,       # Acceleration noise (in pixels/s^2)
+            'ballFilterMeasurementNoise': 2.0,      # Detected position noise (in pixels)
+            'ballFilterMaxLostFrames': 15,          # Predict through at most this many occluded frames
+
             # There are 8 foosball rods, each one measures 5/8" in diameter
             # The total distance across all 8 rods is 40 7/16"
             # This means the distance between two rods is 40 7/16" / (8 - 1) * 2.54 * pxPerCm
@@ -87,6 +136,11 @@ class Foosball:
             # There are 13 total foosmen, each with a unique ID from left to right and top to bottom
             # Each foosmen kicks the ball with feet that measure 1" in width
             'foosmenHeight': 42,                    # Foosmen height (how far they "span" in either direction)
+            'foosmenPerRow': [3, 2, 3, 5, 5, 3, 2, 3],  # Number of foosmen on each rod
+            'foosmenSpacing': [97.54, 131.77, 97.54, 68.45, 68.45, 97.54, 131.77, 97.54],  # Foosmen spacing on each rod (in pixels)
+
+            # Players are only detected every few frames (see trackPlayers()), and the opponent's rods are tracked in between
+            'playerDetectionInterval': 3,           # Detect players every this many frames (1 to detect every frame)
 
             # RED players
             'foosmenRedHSV1Lower': (0, 0, 0),       # Foosmen lower bound (HSV)
@@ -100,7 +154,17 @@ class Foosball:
             'foosmenBlueHSVLower': (85, 0, 0),      # Foosmen lower bound (HSV)
             'foosmenBlueHSVUpper': (110, 255, 255), # Foosmen upper bound (HSV)
             'foosmenBlueContour': (255, 100, 100),  # Foosmen contour highlight color
-            'foosmenBlueBox': (255, 0, 0)           # Foosmen bounding box color
+            'foosmenBlueBox': (255, 0, 0),          # Foosmen bounding box color
+
+            # Pixels are labeled with a lookup table built from the HSV bounds above, instead of converting
+            # every frame to HSV. The table is rebuilt when the HSV bounds change, and cached to disk.
+            'colorLUT': True,                       # Use lookup table instead of HSV conversion
+            'colorLUTCacheDir': os.path.join(os.path.expanduser("~"), ".cache", "foosball"),  # Lookup table cache
+
+            # Objects are found as blobs of connected pixels in each color mask, with either
+            # cv2.findContours ("contours") or cv2.connectedComponentsWithStats ("components")
+            # See scripts/benchmarkBlobs.py to compare the two: labeling every pixel is slower on our sparse masks
+            'blobDetector': "contours",             # Blob detection backend
         }
 
         # Variable to determine if a game is currently in progress or not
@@ -118,6 +182,43 @@ class Foosball:
         self.numFrames = 0
         self.fps = None
 
+        # Capture timestamp of the current frame, and the time between it and the previous frame (in seconds)
+        self.startClock = None
+        self.frameTimestamp = None
+        self.frameTime = None
+
+        # Raw camera frame, either BGR or YUV420 (I420, a grayscale Y plane followed by quarter-size U and V planes)
+        self.rawFrame = None
+        self.rawFormat = "bgr"
+
+        # Table frame (cropped from the raw camera frame) and the output image drawn on top of it
+        # These buffers are reused on every frame instead of being reallocated
+        self.frame = None
+        self.outputImg = None
+
+        # Whether detections are drawn and the output frame is built, ie False when there is no preview or recording
+        # The output image is part of the output frame being built (see renderer.py), and is None when not rendering
+        self.render = True
+        self.renderer = None
+        self.tableYUV = None
+
+        # Blurred and HSV copies (or color labels) of the current table frame, shared by all detectors
+        # These are computed once per frame and cached using the frame number
+        self.blurred = None
+        self.hsv = None
+        self.labels = None
+        self.hsvFrameNum = None
+
+        # Lookup table of color labels (see colorlut.py), built on the first frame
+        self.colorLUT = None
+        self.colorLUTRanges = None
+
+        # Frames filled with each color blobs are drawn in (see _drawBlobs())
+        self.blobColors = {}
+
+        # Color masks of each player's foosmen (see _getPlayerMasks())
+        self.playerMasks = {}
+
 
     # Start game
     def start(self):
@@ -130,6 +231,27 @@ class Foosball:
         bL = (43,395)
         self.tableCoords = [tL, tR, bR, bL]
 
+        # Create ArUco detector once, since the dictionary and parameters never change
+        self.arucoDict = aruco.Dictionary_get(aruco.DICT_4X4_50)
+        self.arucoParameters = aruco.DetectorParameters_create()
+
+        # Last known ArUco marker corners, and when markers should be detected next
+        self.markerCorners = {}
+        self.framesSinceAruco = 0
+        self.arucoRetry = True
+        self.arucoStats = {"frames": 0, "skipped": 0, "moved": 0, "fullDetections": 0, "roiDetections": 0, "fullTime": 0.0, "roiTime": 0.0}
+
+        # Perspective transformation and remap tables, computed from `tableCoords` when needed
+        self.perspectiveCoords = None
+        self.perspectiveMatrix = None
+        self.perspectiveMaps = None
+        self.perspectiveChromaMaps = None
+
+        # Load (or build) the color lookup table now, rather than on the first frame, since building it takes seconds
+        # It is only built again if the HSV ranges change (see _getColorLUT())
+        if self.vars["colorLUT"]:
+            self._getColorLUT()
+
         # Start game
         self.gameIsActive = True
         self.ballIsInPlay = False
@@ -142,11 +264,32 @@ class Foosball:
         self.projectedPosition = None
         #self.projectedWallPosition = None
 
+        # Kalman filter for foosball position and velocity
+        self.ballFilter = BallFilter(self.vars["ballFilterAcceleration"], self.vars["ballFilterProcessNoise"], self.vars["ballFilterMeasurementNoise"])
+
+        # Y-coordinates, and the number, of the players detected on each foosmen rod, updated by findPlayers()
+        # All of each player's detected foosmen are also kept together (see PLAYER_DTYPE), sorted by rod and y-coordinate
+        self.playerPositions = [[] for row in self.vars["rowPosition"]]
+        self.playerCounts = np.zeros(len(self.vars["rowPosition"]), dtype="int")
+        self.players = {"RED": np.empty(0, dtype=PLAYER_DTYPE), "BLUE": np.empty(0, dtype=PLAYER_DTYPE)}
+
+        # Opponent's foosmen, tracked between player detections (see trackPlayers())
+        self.playerTracker = None
+        self.opponents = np.empty(0, dtype=TRACKED_DTYPE)
+        self.framesSincePlayers = 0
+        self.playerDetectionStats = {"detected": 0, "tracked": 0}
+
+        # Number of times the foosball was searched for in a window vs the whole frame
+        self.ballSearchStats = {"window": 0, "coarse": 0, "full": 0}
+
         # Initialize score to 0-0
         self.score = [0, 0]
 
         # Start timer
         self.startTime = datetime.datetime.now()
+        self.startClock = time.perf_counter()
+        self.frameTimestamp = None
+        self.frameTime = None
 
         return self
 
@@ -154,6 +297,10 @@ class Foosball:
     # Add current foosball position and calculate motion
     def _addCurrentPosition(self, pos):
 
+        # If the ball was lost for a while, start a new track instead of connecting the two
+        if self.lostBallFrames > self.vars["ballFilterMaxLostFrames"]:
+            self.ballFilter.reset()
+
         # Reset counter of how many frames the foosball has been undetected
         self.lostBallFrames = 0
 
@@ -162,47 +309,23 @@ class Foosball:
         if len(self.ballPositions) > self.vars["foosballMaxPositions"]:
             self.ballPositions.pop(0)
 
-        # If this is the first point, then the next projected position will be the same as the current point
-        if len(self.ballPositions) < 2:
-            if self.debug:
-                self.log("[DEBUG] We only have one point. Projected position will be the same.")
-            self.deltaX = 0
-            self.deltaY = 0
-
-        # If we only have two points, then calculate deltas between the last 2 known points
-        elif len(self.ballPositions) < 3:
-            self.deltaX = int((self.ballPositions[-1:][0][0] - self.ballPositions[-2:][0][0]) / 1)
-            self.deltaY = int((self.ballPositions[-1:][0][1] - self.ballPositions[-2:][0][1]) / 1)
-
-        # Otherwise, calculate deltas based on last 3 known points
-        else:
-            self.deltaX = int((self.ballPositions[-1:][0][0] - self.ballPositions[-3:][0][0]) / 2)
-            self.deltaY = int((self.ballPositions[-1:][0][1] - self.ballPositions[-3:][0][1]) / 2)
-
-        # Ignore deltas unless there is "significant" movement
-        if abs(self.deltaX) + abs(self.deltaY) < 2:
-            if self.debug:
-                self.log("[DEBUG] Ignore insignificant movement for projected positions")
-            self.deltaX = 0
-            self.deltaY = 0
+        # Update the ball filter with the detected position
+        self.ballFilter.update(pos, self.elapsedTime)
 
-        # Calculate which wall the ball will hit next, assuming it continues uninterrupted
-        #self._getIntersectingWallPosition()
+        # Deltas are the expected movement until the next frame (in pixels)
+        # Use the time since the previous frame if avaialble, otherwise default to 30fps
+        frameTime = self.frameTime or 1 / 30
+        vx, vy = self.ballFilter.velocity()
+        self.deltaX = vx * frameTime
+        self.deltaY = vy * frameTime
 
         # Calculate projected next coordinate
-        self.projectedPosition = (self.ballPositions[-1:][0][0] + self.deltaX, self.ballPositions[-1:][0][1] + self.deltaY)
+        self.projectedPosition = self._getProjectedPosition(frameTime)
 
-        # Calculate distance (in cm), velocity, and direction -- for visual display only
+        # Calculate distance (in cm) and velocity (in m/s) -- for visual display only
         distancePX = math.sqrt(self.deltaX * self.deltaX + self.deltaY * self.deltaY)
         self.distance = distancePX / self.vars["pxPerCm"]
-
-        # Velocity
-        # Use FPS if avaialble, otherwise default to 30fps
-        distanceM = self.distance / 100
-        if self.fps:
-            self.velocity = distanceM / (1 / self.fps)
-        else:
-            self.velocity = distanceM / (1 / 30)
+        self.velocity = math.sqrt(vx * vx + vy * vy) / self.vars["pxPerCm"] / 100
 
         # Direction
         # Calculate number degrees between two points
@@ -214,17 +337,25 @@ class Foosball:
             #self.degrees = degrees_temp
 
 
+    # Predict the foosball position, velocity, and position covariance `t` seconds after the current frame
+    # Returns (None, None, None) if the foosball has not been detected yet
+    def predict(self, t=0):
+        return self.ballFilter.predict(self.elapsedTime + t)
+
+
+    # Get projected foosball coordinate `t` seconds after the current frame, rounded to the nearest pixel
+    def _getProjectedPosition(self, t):
+        pos, vel, cov = self.predict(t)
+        return (int(round(pos[0])), int(round(pos[1])))
+
+
     # Function to update video display
     def buildOutputFrame(self):
         if self.debug:
             self.log("[DEBUG] Update display begin")
 
-        # Build output
-        out = np.zeros((self.vars["outputHeight"], self.vars["outputWidth"], 3), dtype="uint8")
-        vPos = self.vars["height"] + 4
-
-        # Output image
-        out[0:self.vars["height"], 0:self.vars["width"]] = self.outputImg
+        # The output image is already part of the output frame, so only the metrics need to be drawn
+        renderer = self._getRenderer()
 
         # Key metrics
         metrics = {
@@ -243,29 +374,29 @@ class Foosball:
             "Projected": ("{}".format(self.projectedPosition)) if self.projectedPosition is not None else "-",
             #"Wall": ("{}".format(self.projectedWallPosition)) if self.projectedWallPosition is not None else "-",
         }
-        for key in metrics:
-            vPos += 18
-            cv2.putText(out, "%s: %s" % (key, metrics[key]), (10, int(vPos)), self.vars["outputFont"], 1, (255, 255, 255), 1)
+        for i, key in enumerate(metrics):
+            renderer.drawText(0, i, "%s: %s" % (key, metrics[key]))
+        for i, key in enumerate(metricsRight):
+            renderer.drawText(1, i, "%s: %s" % (key, metricsRight[key]))
+        out = renderer.finish()
 
-        vPos = self.vars["height"] + 4
-
-        for key in metricsRight:
-            vPos += 18
+        if self.debug:
+            self.log("[DEBUG] Update display end")
 
-            # get boundary of this text
-            text = "%s: %s" % (key, metricsRight[key])
-            textsize = cv2.getTextSize(text, self.vars["outputFont"], 1, 2)[0]
+        return out
 
-            # get coords based on boundary
-            textX = self.vars["width"] - textsize[0] - 10
 
-            # add text centered on image
-            cv2.putText(out, text, (int(textX), int(vPos)), self.vars["outputFont"], 1, (255, 255, 255), 1)
+    # Give an output frame returned by buildOutputFrame() back, once it has been shown or recorded
+    def releaseOutputFrame(self, out):
+        if out is not None and self.renderer is not None:
+            self.renderer.release(out)
 
-        if self.debug:
-            self.log("[DEBUG] Update display end")
 
-        return out
+    # Get the renderer of output frames, created on first use
+    def _getRenderer(self):
+        if self.renderer is None:
+            self.renderer = OutputRenderer((self.vars["outputWidth"], self.vars["outputHeight"]), (self.vars["width"], self.vars["height"]), self.vars["outputFont"])
+        return self.renderer
 
 
     # Determine if a goal was scored or not
@@ -284,6 +415,7 @@ class Foosball:
 
         # Check for score
         lastKnownX = self.ballPositions[-1:][0][0]
+        lastProjectedX = self.projectedPosition[0]
 
         # Computer Goal
         if lastKnownX < 10 and lastProjectedX < 10:
@@ -311,19 +443,26 @@ class Foosball:
         if self.debug:
             self.log("[DEBUG] Detect Foosball begin")
 
-        origImg = self.frame.copy()
-
-        # Convert to HSV color range
-        self.blurred = cv2.GaussianBlur(origImg, (11, 11), 0)
-        self.hsv = cv2.cvtColor(self.blurred, cv2.COLOR_BGR2HSV)
-
-        # Create mask and perform morphological "opening" to remove small blobs in mask.
-        # Opening erodes an image and then dilates the eroded image, using the same structuring
-        # element for both operations. This is useful for removing small objects from an image
-        # while preserving the shape and size of larger objects in the image.
-        mask = cv2.inRange(self.hsv, self.vars["foosballHSVLower"], self.vars["foosballHSVUpper"])
-        mask = cv2.erode(mask, None, iterations=2)
-        mask = cv2.dilate(mask, None, iterations=2)
+        # If the ball was found on the previous frame, only search a window around its projected position
+        # Otherwise (or if the ball is not inside the window), search the whole frame
+        # Whole frame searches look for candidates at a lower resolution first, if enabled. If there are none,
+        # the foosball is not in view, but if a candidate is not confirmed at full resolution, the whole frame is searched
+        blobs = []
+        searched = False
+        if self.vars["ballTracking"] and self.lostBallFrames == 0 and self.projectedPosition is not None:
+            window = self._getBallSearchWindow()
+            blobs, mask = self._getBallBlobs(window)
+            self.ballSearchStats["window"] += 1
+        if len(blobs) == 0 and self.vars["ballPyramidLevels"] > 0:
+            window = self._findCoarseBall()
+            searched = window is None
+            if window is not None:
+                blobs, mask = self._getBallBlobs(window)
+            self.ballSearchStats["coarse"] += 1
+        if len(blobs) == 0 and not searched:
+            window = (0, 0, self.vars["width"], self.vars["height"])
+            blobs, mask = self._getBallBlobs(window)
+            self.ballSearchStats["full"] += 1
 
         #self.radius = None
         self.distance = None
@@ -331,36 +470,30 @@ class Foosball:
         self.velocity = None
 
         # Find largest contour in mask
-        cnts = self._getContours(mask)
         # Sort from largest to smallest
         #cnts = sorted(cnts, key=cv2.contourArea, reverse=True)
         #if self.debug:
             #self.log("[DEBUG] Contours found: {}".format(len(cnts)))
 
         if self.debug:
-            self.log("[DEBUG] {} contour(s) found".format(len(cnts)))
+            self.log("[DEBUG] {} blob(s) found".format(len(blobs)))
 
-        if len(cnts) > 0:
+        if len(blobs) > 0:
 
-            # Draw all contours on output image
-            for c in cnts:
-                #perimeter = cv2.arcLength(c, True)
-                #epsilon = 0.04 * perimeter
-                #approx = cv2.approxPolyDP(c, epsilon, True)
-                cv2.drawContours(self.outputImg, [c], -1, (30, 255, 255), -1)
+            # Draw all blobs on output image
+            self._drawBlobs(mask, window, (30, 255, 255))
 
-            # Find largest contour and draw on output image with a different color
-            c = max(cnts, key=cv2.contourArea)
-            cv2.drawContours(self.outputImg, [c], -1, (60, 255, 255), -1)
+            # Find largest blob and draw on output image with a different color
+            b = blobs[np.argmax(blobs["area"])]
+            self._drawBlobs(mask, window, (60, 255, 255), b)
 
 
             self.foosballDetected = True
             self.ballIsInPlay = True
 
-            # compute the minimum enclosing circle and centroid
+            # Use the centroid
             #((x, y), self.radius) = cv2.minEnclosingCircle(c)
-            M = cv2.moments(c)
-            self.foosballPosition = (int(M["m10"] / M["m00"]), int(M["m01"] / M["m00"]))
+            self.foosballPosition = (int(b["cx"]), int(b["cy"]))
 
             # Add current position to the list of tracked points
             self._addCurrentPosition(self.foosballPosition)
@@ -400,7 +533,10 @@ class Foosball:
                 self.log("[INFO] The ball was in play and it looks like a goal occurred!")
 
             # At this point, we know the ball is likely occluded
+            # Keep predicting its position from the last known position and velocity
             else:
+                if self.lostBallFrames <= self.vars["ballFilterMaxLostFrames"]:
+                    self.projectedPosition = self._getProjectedPosition(self.frameTime or 1 / 30)
                 self.log("[INFO] The ball is likely occluded. Last known projected coordinates: {}".format(self.projectedPosition))
 
         self.log("[INFO] Foosball detected: {}".format(self.foosballDetected))
@@ -414,6 +550,8 @@ class Foosball:
     # Take current image, find goal using location detetction,
     # and overlay rectangular area on output image
     def findGoal(self):
+        if not self.render:
+            return
         if self.debug:
             self.log("[DEBUG] Find Goal begin")
 
@@ -434,142 +572,234 @@ class Foosball:
 
     # Take current image, perform object recognition,
     # and convert this information into the coordinates of the RED and BLUE players
+    # Returns the detected foosmen of `mode` (see PLAYER_DTYPE), which are also saved in `players`
     def findPlayers(self, mode, myPlayer = False):
         if self.debug:
             self.log("[DEBUG] Detect players begin")
 
-        origImg = self.frame.copy()
-
-        # Convert to HSV color range
-        blurred = cv2.GaussianBlur(origImg, (11, 11), 0)
-        hsv = cv2.cvtColor(blurred, cv2.COLOR_BGR2HSV)
-
         # Set variables based on mode (RED or BLUE)
         self.foosmenDetected = False
-        if mode == "RED":
-            contourRGB = self.vars["foosmenRedContour"]
-            rectangleRGB = self.vars["foosmenRedBox"]
-            foosmenRodArray = self.vars["foosmenRED"]
-
-            # Create color mask for foosmen and perform erosions and dilation to remove small blobs in mask
-            mask1 = cv2.inRange(hsv, self.vars["foosmenRedHSV1Lower"], self.vars["foosmenRedHSV1Upper"])
-            mask2 = cv2.inRange(hsv, self.vars["foosmenRedHSV2Lower"], self.vars["foosmenRedHSV2Upper"])
-            mask = cv2.bitwise_or(mask1, mask2)
-            mask = cv2.erode(mask, None, iterations=4)
-            mask = cv2.dilate(mask, None, iterations=4)
-
-        elif mode == "BLUE":
-            contourRGB = self.vars["foosmenBlueContour"]
-            rectangleRGB = self.vars["foosmenBlueBox"]
-            foosmenRodArray = self.vars["foosmenBLUE"]
-
-            # Create color mask for foosmen and perform erosions and dilation to remove small blobs in mask
-            mask = cv2.inRange(hsv, self.vars["foosmenBlueHSVLower"], self.vars["foosmenBlueHSVUpper"])
-            mask = cv2.erode(mask, None, iterations=4)
-            mask = cv2.dilate(mask, None, iterations=4)
-
-        else:
+        if mode not in self.players:
             self.log("[ERROR] Invalid `mode` in findPlayers() function")
             return
 
-        # Draw line over each roosmen rod
-        #for i, xPos in enumerate(foosmenRodArray):
-        for row in foosmenRodArray:
-            xPos = self.vars["rowPosition"][row]
-            self.outputImg = cv2.line(self.outputImg, (xPos, 0), (xPos, self.vars["height"] - 1), (0, 255, 0), 2)
+        players, rows = self._findRodBlobs([(row, mode) for row in self._getPlayerRows(mode)])
+        dp = self._savePlayers(mode, players, rows, myPlayer)
 
-        # Detect foosmen using contours
-        players = self._getContours(mask)
+        if self.debug:
+            self.log("[DEBUG] Detect players end")
 
-        # Loop through players to filter out false positives
-        detectedPlayers = []
-        for i in players:
+        return dp
 
-            # Get coordinates of bounding rectangle
-            x, y, w, h = cv2.boundingRect(i)
 
-            # Draw rectangle on output image
-            cv2.drawContours(self.outputImg, [i], -1, contourRGB, -1)
-            cv2.rectangle(self.outputImg, (x, y), (x + w, y + h), rectangleRGB, 2)
+    # Find the RED and BLUE players together, which is the same as calling findPlayers() for each,
+    # but the blobs of both players are found in one call (see _findRodBlobs())
+    # `myPlayer` is the mode of the player the table controls
+    # Returns a dictionary of mode: detected foosmen (see findPlayers())
+    def findAllPlayers(self, myPlayer="BLUE"):
+        if self.debug:
+            self.log("[DEBUG] Detect all players begin")
 
-            # Filter contours that are adjacent to the top or bottom of the table
-            # We do this by using `rowMargin`, which stores the height of the "bumpers" on each side of the foosmen rod
-            if ((y < self.vars["rowMargin"]) | (y > (self.vars["height"] - self.vars["rowMargin"]))):
-                continue
+        self.foosmenDetected = False
+        rowModes = [(row, mode) for mode in self.players for row in self._getPlayerRows(mode)]
+        players, rows = self._findRodBlobs(rowModes)
 
-            # Filter contours with abnormal width (smaller than acceptable width)
-            if (h < 10):
-                continue
+        detected = {}
+        for mode in self.players:
+            isMode = np.zeros(len(self.vars["rowPosition"]), dtype="bool")
+            isMode[self._getPlayerRows(mode)] = True
+            isMode = isMode[rows]
+            detected[mode] = self._savePlayers(mode, players[isMode], rows[isMode], mode == myPlayer)
+
+        if self.debug:
+            self.log("[DEBUG] Detect all players end")
+
+        return detected
+
+
+    # Find `myPlayer`'s foosmen on every frame, and the opponent's every `playerDetectionInterval` frames,
+    # tracking the opponent's rods from one detection to the next
+    # The opponent's foosmen are also detected whenever one of their rods is not being tracked
+    # On frames without detection, no foosmen are detected for the opponent (ie their `playerPositions` are empty)
+    # Returns the opponent's foosmen on this frame (see PlayerTracker.predict()), which are also saved in `opponents`
+    def trackPlayers(self, myPlayer="BLUE"):
+        opponent = "RED" if myPlayer == "BLUE" else "BLUE"
+        if self.playerTracker is None:
+            self.playerTracker = PlayerTracker(self._getPlayerRows(opponent), self.vars["rowPosition"], self.vars["foosmenPerRow"], self.vars["foosmenSpacing"], self.vars["foosmenHeight"])
+
+        self.framesSincePlayers += 1
+        if self.framesSincePlayers >= self.vars["playerDetectionInterval"] or not self.playerTracker.isTracking():
+            detected = self.findAllPlayers(myPlayer)
+            self.playerTracker.update(detected[opponent], self.frameTimestamp)
+            self.framesSincePlayers = 0
+            self.playerDetectionStats["detected"] += 1
+        else:
+            self.findPlayers(myPlayer, True)
+            self.players[opponent] = np.empty(0, dtype=PLAYER_DTYPE)
+            for row in self._getPlayerRows(opponent):
+                self.playerPositions[row] = np.empty(0)
+                self.playerCounts[row] = 0
+            self.playerDetectionStats["tracked"] += 1
+
+        self.opponents = self.playerTracker.predict(self.frameTimestamp)
+
+        # Draw the center of each tracked foosman on output image
+        if self.render:
+            color = self.vars["foosmenRedBox"] if opponent == "RED" else self.vars["foosmenBlueBox"]
+            for x, y in zip(self.opponents["x"].tolist(), self.opponents["y"].tolist()):
+                cv2.circle(self.outputImg, (x, int(y)), 5, color, -1)
+
+        return self.opponents
 
-            # Normalize xPos based on foosball rod. We do this by looping through
-            # each of the 4 foosmen rods and determining if this contour falls
-            # within an acceptable range of one of them.
-            #for row, xPos in enumerate(foosmenRodArray):
-            for row in foosmenRodArray:
-                xPos = self.vars["rowPosition"][row]
 
-                # Ensure boundaries are within acceptable margins on either side of foosmen rod
-                #if ((x < xPos) & (xPos < (x + w))):
-                if ((x > (xPos - self.vars["foosmenHeight"] - 8)) & (x < xPos) & ((x + w) < (xPos + self.vars["foosmenHeight"] + 8)) & ((x + w) > xPos)):
+    # Get the foosmen rods of a player (RED or BLUE)
+    def _getPlayerRows(self, mode):
+        return self.vars["foosmenRED"] if mode == "RED" else self.vars["foosmenBLUE"]
 
-                    # Add player to detectedPlayers array
-                    # Normalize x-coordinate by using [xPos] instead of [x + (w / 2)]
-                    playerPos = (xPos, y + (h / 2))
-                    detectedPlayers.append([row, playerPos[0], playerPos[1]])
 
-                    # Draw contour and rectangle over player
-                    cv2.drawContours(self.outputImg, [i], -1, contourRGB, -1)
-                    cv2.rectangle(self.outputImg, (x, y), (x + w, y + h), rectangleRGB, 2)
+    # Find blobs of foosmen around each rod, given as a list of (row, mode)
+    # Only the bands of columns the foosmen of each rod can span (see _savePlayers()) are searched, so a blob that
+    # crosses the edge of a band is cut there, and is rejected just like the whole blob would have been
+    # The masks of both players are stacked in one image, so they are filtered together (see _getPlayerMasks())
+    # Returns the blobs (see BLOB_DTYPE) in table coordinates, and the row of each
+    def _findRodBlobs(self, rowModes):
 
-        # Sort by x-coordinate (column 1), then by y-coordinate (column 2)
-        dp = np.array(detectedPlayers)
-        dp = dp[dp[:,2].argsort(kind='mergesort')]
-        dp = dp[dp[:,1].argsort(kind='mergesort')]
+        # Draw line over each roosmen rod
+        #for i, xPos in enumerate(foosmenRodArray):
+        if self.render:
+            for row, mode in rowModes:
+                xPos = self.vars["rowPosition"][row]
+                self.outputImg = cv2.line(self.outputImg, (xPos, 0), (xPos, self.vars["height"] - 1), (0, 255, 0), 2)
+
+        modes = tuple(mode for mode in self.players if any(rowMode == mode for row, rowMode in rowModes))
+        if len(modes) == 0:
+            return np.empty(0, dtype=BLOB_DTYPE), np.empty(0, dtype="int64")
+
+        # Create color masks for foosmen, and the second buffer they are filtered into, both reused between frames
+        # Perform erosions and dilation to remove small blobs in mask, on a view of each band's columns
+        # The rows between the masks are cleared after the erosions, so to both filters they are like the frame's edge
+        mask, opened, offsets = self._getPlayerMasks(modes)
+        height = self.vars["height"]
+        rows = sorted((row for row, mode in rowModes), key=lambda row: self.vars["rowPosition"][row])
+        for bandRows, (x0, x1), (c0, c1) in self._getRodBands(rows):
+            cv2.erode(mask[:, x0:x1], None, dst=opened[:, x0:x1], iterations=4)
+            for y0 in offsets[1:]:
+                opened[y0 - self.playerMaskGap:y0, x0:x1] = 0
+            cv2.dilate(opened[:, x0:x1], None, dst=opened[:, x0:x1], iterations=4)
+
+        allPlayers = []
+        allRows = []
+        for mode, y0 in zip(modes, offsets):
+            modeRows = sorted((row for row, rowMode in rowModes if rowMode == mode), key=lambda row: self.vars["rowPosition"][row])
+            contourRGB = self.vars["foosmenRedContour"] if mode == "RED" else self.vars["foosmenBlueContour"]
+
+            for bandRows, (x0, x1), (c0, c1) in self._getRodBands(modeRows):
+
+                # Detect foosmen as blobs, and find the rod of each: the first rod to the right of the blob's left edge,
+                # which is the only one it can span (see _savePlayers()), since each player's rods are far apart
+                band = opened[y0:y0 + height, c0:c1]
+                players = self._getBlobs(band, (c0, 0))
+                rodPositions = np.array([self.vars["rowPosition"][row] for row in bandRows])
+                index = np.minimum(np.searchsorted(rodPositions, players["x"], side="right"), len(bandRows) - 1)
+                allPlayers.append(players)
+                allRows.append(np.array(bandRows)[index])
+
+                # Draw every blob on output image
+                self._drawBlobs(band, (c0, 0), contourRGB)
+
+        return np.concatenate(allPlayers), np.concatenate(allRows)
+
+
+    # Group rods (sorted by position) into bands of columns, joining rods whose bands would overlap once filtered
+    # Erosions and dilations each look 4 pixels away, so each band is filtered with 8 more columns on either side
+    # Returns a list of (rows, filtered columns (x0, x1), searched columns (c0, c1)) for each band
+    def _getRodBands(self, rows):
+        reach = self.vars["foosmenHeight"] + 8
+        pad = 8
+        width = self.vars["width"]
+
+        bands = []
+        for row in rows:
+            xPos = self.vars["rowPosition"][row]
+            c0, c1 = max(xPos - reach, 0), min(xPos + reach, width)
+            if len(bands) > 0 and c0 - pad <= bands[-1][2][1] + pad:
+                bands[-1][0].append(row)
+                bands[-1][2] = (bands[-1][2][0], c1)
+            else:
+                bands.append([[row], None, (c0, c1)])
+
+        for band in bands:
+            c0, c1 = band[2]
+            band[1] = (max(c0 - pad, 0), min(c1 + pad, width))
+        return bands
+
+
+    # Keep the blobs found around a player's rods that are foosmen, and save them (see findPlayers())
+    def _savePlayers(self, mode, players, rows, myPlayer):
+        rectangleRGB = self.vars["foosmenRedBox"] if mode == "RED" else self.vars["foosmenBlueBox"]
+        foosmenRodArray = self._getPlayerRows(mode)
+
+        # Draw the bounding rectangle of every blob on output image
+        if self.render:
+            for x, y, w, h in zip(players["x"].tolist(), players["y"].tolist(), players["w"].tolist(), players["h"].tolist()):
+                cv2.rectangle(self.outputImg, (x, y), (x + w, y + h), rectangleRGB, 2)
+
+        # Filter blobs that are adjacent to the top or bottom of the table
+        # We do this by using `rowMargin`, which stores the height of the "bumpers" on each side of the foosmen rod
+        # Also filter blobs with abnormal width (smaller than acceptable width)
+        # Then ensure boundaries are within acceptable margins on either side of their strip's foosmen rod
+        x, y, w, h = players["x"], players["y"], players["w"], players["h"]
+        xPos = np.array(self.vars["rowPosition"])[rows]
+        reach = self.vars["foosmenHeight"] + 8
+        keep = (y >= self.vars["rowMargin"]) & (y <= (self.vars["height"] - self.vars["rowMargin"])) & (h >= 10)
+        keep &= (x > (xPos - reach)) & (x < xPos) & ((x + w) < (xPos + reach)) & ((x + w) > xPos)
+
+        # Normalize x-coordinate by using [xPos] instead of [x + (w / 2)]
+        # Sort by x-coordinate, then by y-coordinate
+        dp = np.empty(np.count_nonzero(keep), dtype=PLAYER_DTYPE)
+        dp["row"] = rows[keep]
+        dp["x"] = xPos[keep]
+        dp["y"] = y[keep] + h[keep] / 2
+        dp["bbox"] = np.stack((x, y, w, h), axis=-1)[keep]
+        dp = dp[np.lexsort((dp["y"], dp["x"]))]
+        self.players[mode] = dp
+
+        # Save y-coordinates, and the number of players, detected on each foosmen rod
+        counts = np.bincount(dp["row"], minlength=len(self.vars["rowPosition"]))
+        for row in foosmenRodArray:
+            self.playerPositions[row] = dp["y"][dp["row"] == row]
+            self.playerCounts[row] = counts[row]
 
         # Loop through detected players
         if myPlayer:
-            totPlayersRow0 = 0
-            totPlayersRow1 = 0
-            totPlayersRow3 = 0
-            totPlayersRow5 = 0
-
-            for i, p in enumerate(dp):
+            for i, (row, x, y) in enumerate(zip(dp["row"].tolist(), dp["x"].tolist(), dp["y"].tolist())):
                 if self.debug:
-                    self.log("[DEBUG] Player {} detected in foosmen rod {} with center at ({}, {})".format(i, p[0], p[1], p[2]))
-
-                if p[0] == 0:
-                    totPlayersRow0 += 1
-                elif p[0] == 1:
-                    totPlayersRow1 += 1
-                elif p[0] == 2:
-                    totPlayersRow3 += 1
-                elif p[0] == 3:
-                    totPlayersRow5 += 1
+                    self.log("[DEBUG] Player {} detected in foosmen rod {} with center at ({}, {})".format(i, row, x, y))
 
                 # Add text to "tag" each detected player, center in each player box
+                if not self.render:
+                    continue
                 text = "P%s" % (i + 1)
                 textsize = cv2.getTextSize(text, self.vars["outputFont"], 1, 2)[0]
-                textX = p[1] - (textsize[0] / 2)
-                textY = p[2] + (textsize[1] / 2)
+                textX = x - (textsize[0] / 2)
+                textY = y + (textsize[1] / 2)
                 cv2.putText(self.outputImg, text, (int(textX), int(textY)), self.vars["outputFont"], 1, (255, 255, 255), 1)
 
             # Check if all players are detected
             if self.debug:
-                self.log("[INFO] Total players detected in foosmen rod {}: {}".format(0, totPlayersRow0))
-                self.log("[INFO] Total players detected in foosmen rod {}: {}".format(1, totPlayersRow1))
-                self.log("[INFO] Total players detected in foosmen rod {}: {}".format(3, totPlayersRow3))
-                self.log("[INFO] Total players detected in foosmen rod {}: {}".format(5, totPlayersRow5))
-            if ((totPlayersRow0 == 3) & (totPlayersRow1 == 2) & (totPlayersRow3 == 5) & (totPlayersRow5 == 3)):
+                for row in foosmenRodArray:
+                    self.log("[INFO] Total players detected in foosmen rod {}: {}".format(row, counts[row]))
+            total = sum(self.vars["foosmenPerRow"][row] for row in foosmenRodArray)
+            if all(counts[row] == self.vars["foosmenPerRow"][row] for row in foosmenRodArray):
                 self.playersDetected = True
-                self.log("[INFO] All 13 players detected")
+                self.log("[INFO] All {} players detected".format(total))
             else:
                 self.playersDetected = False
-                self.log("[INFO] All 13 players NOT detected")
+                self.log("[INFO] All {} players NOT detected".format(total))
 
         # TODO: Take action based on ball position and detected players
 
-        if self.debug:
-            self.log("[DEBUG] Detect players end")
+        return dp
 
 
     # Detect ArUco markers and transform perspective
@@ -578,204 +808,518 @@ class Foosball:
         if self.debug:
             self.log("[DEBUG] Detect table begin")
 
-        origImg = self.rawFrame.copy()
+        # The raw frame is only read from, so it is not copied
+        origImg = self.rawFrame
 
-        self.arucoDetected = False
+        # Because the table only moves occasionally, ArUco markers are only detected every few frames
+        # In between, the last known table coordinates (and cached perspective transformation) are reused
+        self.arucoStats["frames"] += 1
+        self.framesSinceAruco += 1
+        if self.arucoRetry or self.framesSinceAruco >= self.vars["arucoInterval"]:
+            self._findMarkers(self._getGrayFrame())
+        else:
+            self.arucoStats["skipped"] += 1
+            if self.debug:
+                self.log("[DEBUG] Skip ArUco marker detection, use last known table coordinates")
 
 
-        # Detect ArUco markers
-        # `corners` is the list of corners returned in clockwise order: top left, top right, bottom right, bottom left
-        # `ids` is a list of marker IDs of each of the detected markers
-        gray = cv2.cvtColor(origImg, cv2.COLOR_BGR2GRAY)
-        arucoDict = aruco.Dictionary_get(aruco.DICT_4X4_50)
-        arucoParameters =  aruco.DetectorParameters_create()
-        corners, ids, rejectedImgPoints = aruco.detectMarkers(gray, arucoDict, parameters=arucoParameters)
-        #print(ids)
+        # Apply projective transformation (also known as "perspective transformation" or "homography") to the
+        # original image. This type of transformation was chosen because it preserves straight lines.
+        # To do this, we first compute the transformational matrix (M) and then apply it to the original image.
+        # The resulting frame will have an aspect ratio identical to the size (in pixels) of the foosball playing field
+        # The matrix is only recomputed when the table moves, and is applied using precomputed remap tables
+        # YUV420 frames are warped one plane at a time, and only the table is converted to color
+        map1, map2 = self._getPerspectiveMaps()
+        if self.rawFormat == "yuv":
+            self.frame = self._remapYUV(origImg)
+        else:
+            self.frame = cv2.remap(origImg, map1, map2, cv2.INTER_LINEAR, dst=self.frame)
 
-        # Make sure we found at least one markerId
-        if ids is not None:
+        # Save output frame, to be used later for overlays and output display
+        # It is copied straight into the output frame being built, and not at all when nothing is rendered
+        if self.render:
+            self.outputImg = self._getRenderer().getImage()
+            np.copyto(self.outputImg, self.frame)
+        else:
+            self.outputImg = None
 
-            # Iterate through detected markers
-            detectedMarkers = []
-            for i in range(len(ids)):
-                markerId = int(str(ids[i][0]))
-                marker = np.squeeze(corners[i])
-                x0, y0 = marker[0]
-                #if self.debug:
-                    #self.log("[DEBUG] MarkerId {} detected at ({}, {})".format(markerId, x0, y0))
-
-                # Account for difference between marker position and corner of table
-                #detectedMarkers.append([markerId, x0, y0])
-                if markerId == 0:
-                    #tL = (36,111)
-                    #tL = (58,118)
-                    detectedMarkers.append([markerId, x0 + 22, y0 + 7])
-                elif markerId == 1:
-                    #tR = (568,123)
-                    #tR = (544,130)
-                    detectedMarkers.append([markerId, x0 - 24, y0 + 7])
-                elif markerId == 2:
-                    #bR = (570,401)
-                    #bR = (544,409)
-                    detectedMarkers.append([markerId, x0 - 26, y0 + 8])
-                elif markerId == 3:
-                    #bL = (21,388)
-                    #bL = (43,395)
-                    detectedMarkers.append([markerId, x0 + 22, y0 + 7])
-
-            # Sort by markerId (column 0)
-            dm = np.array(detectedMarkers)
-            dm = dm[dm[:,0].argsort(kind='mergesort')]
+        # The table frame changed, so any cached HSV image is now stale
+        self.hsvFrameNum = None
 
-            if self.debug:
-                self.log("[DEBUG] {} ArUco markers detected".format(len(dm)))
-                for i, m in enumerate(dm):
-                    self.log("[DEBUG] MarkerId {} detected at ({}, {})".format(m[0], m[1], m[2]))
-
-            # Update coordinates if exactly 4 ArUco markers were found
-            if len(dm) == 4:
-                self.arucoDetected = True
-                self.tableCoords = []
-                for i, m in enumerate(dm):
-                    self.tableCoords.append((m[1], m[2]))
-                self.log("[INFO] 4 ArUco markers detected, update table coordinates")
-                self.log("[INFO] ArUco marker coordinates: {}".format(self.tableCoords))
+        if self.debug:
+            self.log("[DEBUG] Detect table end")
+
+        return self.frame
 
-            else:
-                if self.debug:
-                    self.log("[DEBUG] ArUco markers detected but not 4 total")
 
+    # Detect ArUco markers and update table coordinates if all 4 markers are found
+    # Markers are searched for near their last known positions first, then across the whole frame
+    def _findMarkers(self, gray):
+        self.framesSinceAruco = 0
+        self.arucoDetected = False
+        startTime = time.perf_counter()
+
+        # Search small regions around the last known marker positions
+        markers = None
+        if len(self.markerCorners) == 4:
+            markers = self._detectMarkersNearby(gray)
+            if markers is not None:
+                self.arucoStats["roiDetections"] += 1
+                self.arucoStats["roiTime"] += time.perf_counter() - startTime
+
+        # Fall back to searching the whole frame
+        if markers is None:
+            fullStartTime = time.perf_counter()
+            markers = self._detectMarkers(gray)
+            self.arucoStats["fullDetections"] += 1
+            self.arucoStats["fullTime"] += time.perf_counter() - fullStartTime
+
+        if self.debug:
+            self.log("[DEBUG] {} ArUco markers detected".format(len(markers)))
+            for markerId in sorted(markers):
+                self.log("[DEBUG] MarkerId {} detected at ({}, {})".format(markerId, markers[markerId][0][0], markers[markerId][0][1]))
+
+        # Update coordinates if exactly 4 ArUco markers were found
+        if len(markers) == 4:
+            self.arucoDetected = True
+            self.markerCorners = markers
+
+            # Account for difference between marker position and corner of table
+            # Markers are ordered by markerId: top left, top right, bottom right, bottom left
+            tableCoords = []
+            for markerId in sorted(markers):
+                x0, y0 = markers[markerId][0]
+                offsetX, offsetY = self.vars["arucoOffsets"][markerId]
+                tableCoords.append((x0 + offsetX, y0 + offsetY))
+
+            # If the table moved since the last detection, check again on the next frame
+            # Otherwise, go back to detecting markers every `arucoInterval` frames
+            moved = np.abs(np.array(tableCoords) - np.array(self.tableCoords)).max()
+            self.arucoRetry = moved > self.vars["tableCoordsTolerance"]
+            if self.arucoRetry:
+                self.arucoStats["moved"] += 1
+
+            self.tableCoords = tableCoords
+            self.log("[INFO] 4 ArUco markers detected, update table coordinates")
+            self.log("[INFO] ArUco marker coordinates: {}".format(self.tableCoords))
+
+        # Keep checking every frame until all 4 markers are found again
         else:
+            self.arucoRetry = True
             if self.debug:
-                self.log("[DEBUG] No ArUco markers detected, use default table coordinates")
+                self.log("[DEBUG] ArUco markers detected but not 4 total, use last known table coordinates")
 
 
-        # Apply projective transformation (also known as "perspective transformation" or "homography") to the
-        # original image. This type of transformation was chosen because it preserves straight lines.
-        # To do this, we first compute the transformational matrix (M) and then apply it to the original image.
-        # The resulting frame will have an aspect ratio identical to the size (in pixels) of the foosball playing field
+    # Detect ArUco markers in a grayscale image
+    # Returns a dictionary of markerId: corners, where corners are listed in clockwise order:
+    # top left, top right, bottom right, bottom left
+    def _detectMarkers(self, gray, offset=(0, 0)):
+        corners, ids, rejectedImgPoints = aruco.detectMarkers(gray, self.arucoDict, parameters=self.arucoParameters)
+
+        markers = {}
+        if ids is not None:
+            for i in range(len(ids)):
+                markerId = int(ids[i][0])
+                if markerId in self.vars["arucoOffsets"]:
+                    markers[markerId] = np.squeeze(corners[i]) + offset
+        return markers
+
+
+    # Detect ArUco markers only in a small region around each last known marker position
+    # Returns None if any of the markers was not found, so the whole frame can be searched instead
+    def _detectMarkersNearby(self, gray):
+        pad = self.vars["arucoSearchMargin"]
+        h, w = gray.shape[:2]
+
+        markers = {}
+        for markerId, corners in self.markerCorners.items():
+            x0, y0 = np.maximum(corners.min(axis=0).astype(int) - pad, 0)
+            x1, y1 = np.minimum(corners.max(axis=0).astype(int) + pad, (w, h))
+            found = self._detectMarkers(gray[y0:y1, x0:x1], (x0, y0))
+            if markerId not in found:
+                return None
+            markers[markerId] = found[markerId]
+        return markers
+
+
+    # Get summary of how often ArUco markers were detected, and the estimated time saved per frame
+    # compared to detecting markers across the whole frame on every frame
+    def getArucoStats(self):
+        stats = dict(self.arucoStats)
+        frames = max(stats["frames"], 1)
+        avgFullTime = stats["fullTime"] / stats["fullDetections"] if stats["fullDetections"] else 0
+        avgRoiTime = stats["roiTime"] / stats["roiDetections"] if stats["roiDetections"] else 0
+        savedTime = stats["skipped"] * avgFullTime + stats["roiDetections"] * (avgFullTime - avgRoiTime)
+        stats["detectionRate"] = (stats["fullDetections"] + stats["roiDetections"]) / frames
+        stats["savedMsPerFrame"] = 1000 * savedTime / frames
+        return stats
+
+
+    # Get remap tables for the perspective transformation of the current table coordinates
+    # These are cached and only rebuilt when a table corner moves by more than `tableCoordsTolerance`
+    def _getPerspectiveMaps(self):
         origCoords = np.array(self.tableCoords, dtype="float32")
+
+        # Reuse cached remap tables if the table has not moved
+        if self.perspectiveCoords is not None:
+            if np.abs(origCoords - self.perspectiveCoords).max() <= self.vars["tableCoordsTolerance"]:
+                return self.perspectiveMaps
+
+        if self.debug:
+            self.log("[DEBUG] Table coordinates changed, compute perspective transformation")
+
         finalCoords = np.array(self.vars['outputCoords'], dtype="float32")
         M = cv2.getPerspectiveTransform(origCoords, finalCoords)
-        self.frame = cv2.warpPerspective(origImg, M, (self.vars['width'], self.vars['height']))
 
-        # Save output frame, to be used later for overlays and output display
-        self.outputImg = self.frame.copy()
+        # Remap tables for full-resolution images, and for the half-resolution U and V planes of YUV420 images
+        Minv = np.linalg.inv(M)
+        self.perspectiveMaps = self._getRemapTables(Minv, self.vars['width'], self.vars['height'])
+        self.perspectiveChromaMaps = self._getRemapTables(Minv, self.vars['width'] // 2, self.vars['height'] // 2, 2)
 
-        if self.debug:
-            self.log("[DEBUG] Detect table end")
+        self.perspectiveCoords = origCoords
+        self.perspectiveMatrix = M
+
+        return self.perspectiveMaps
+
+
+    # Map every pixel of a (width x height) output image back to its location in the original image
+    # `scale` is 2 for the half-resolution planes of a YUV420 image, where each pixel covers a 2x2 block of full-resolution pixels
+    # Converting to fixed-point maps makes each cv2.remap() call a cheap table lookup
+    def _getRemapTables(self, Minv, width, height, scale=1):
+        xs, ys = np.meshgrid(np.arange(width, dtype="float32"), np.arange(height, dtype="float32"))
+        center = (scale - 1) / 2
+        grid = np.dstack((xs, ys)).reshape(-1, 1, 2) * scale + center
+        srcPoints = cv2.perspectiveTransform(grid, Minv).reshape(height, width, 2)
+        srcPoints = ((srcPoints - center) / scale).astype("float32")
+        return cv2.convertMaps(srcPoints, None, cv2.CV_16SC2)
+
+
+    # Warp a YUV420 frame to the table, then convert only the table to BGR
+    # Each plane is a single channel, so warping them is cheaper than warping a 3 channel BGR frame
+    def _remapYUV(self, yuv):
+        width, height = self.vars['width'], self.vars['height']
+        if self.tableYUV is None:
+            self.tableYUV = np.empty((height * 3 // 2, width), dtype="uint8")
+
+        src = self._getYUVPlanes(yuv)
+        dst = self._getYUVPlanes(self.tableYUV)
+        cv2.remap(src[0], *self.perspectiveMaps, cv2.INTER_LINEAR, dst=dst[0])
+        cv2.remap(src[1], *self.perspectiveChromaMaps, cv2.INTER_LINEAR, dst=dst[1])
+        cv2.remap(src[2], *self.perspectiveChromaMaps, cv2.INTER_LINEAR, dst=dst[2])
+
+        return cv2.cvtColor(self.tableYUV, cv2.COLOR_YUV2BGR_I420, dst=self.frame)
+
+
+    # Get the Y, U, and V planes of a YUV420 (I420) image, without copying them
+    def _getYUVPlanes(self, yuv):
+        height, width = yuv.shape[0] * 2 // 3, yuv.shape[1]
+        flat = yuv.reshape(-1)
+        y = flat[:width * height].reshape(height, width)
+        u = flat[width * height:width * height * 5 // 4].reshape(height // 2, width // 2)
+        v = flat[width * height * 5 // 4:width * height * 3 // 2].reshape(height // 2, width // 2)
+        return y, u, v
 
-        return self.frame
+
+    # Get the raw frame in grayscale, which is all ArUco marker detection needs
+    # YUV420 frames already have one (the Y plane), so it is used directly
+    def _getGrayFrame(self):
+        if self.rawFormat == "yuv":
+            return self._getYUVPlanes(self.rawFrame)[0]
+        return cv2.cvtColor(self.rawFrame, cv2.COLOR_BGR2GRAY)
+
+
+    # Get a BGR copy of the raw frame, ie to display it
+    def getRawFrame(self):
+        if self.rawFormat == "yuv":
+            return cv2.cvtColor(self.rawFrame, cv2.COLOR_YUV2BGR_I420)
+        return self.rawFrame.copy()
 
 
     # Get contours
-    def _getContours(self, mask):
+    # `offset` is added to every contour point, for masks that are a cropped region of the frame
+    def _getContours(self, mask, offset=(0, 0)):
 
         # Detect object using contours
         # We are using OpenCV 4.x, so extract contours from the 1st parameter
-        contours, hierarchy = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        contours, hierarchy = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=offset)
         return contours
 
 
-    # # Determine intersecting y-coordinate based on x-coordinate
-    # def getIntersectingYPos(self, xPos):
-    #
-    #     # Calculate latest two coordinates for interpolation
-    #     x2 = self.ballPositions[-1:][0][0]
-    #     y2 = self.ballPositions[-1:][0][1]
-    #     x1 = x2 - self.deltaX
-    #     y1 = y2 - self.deltaY
-    #
-    #     yPos = self._interpolate(xPos, x2, y2, x1, y1)
-    #
-    #     # Intersecting yPos is out of bounds
-    #     while yPos < 0 or yPos > self.vars["height"]:
-    #         if yPos > self.vars["height"]:
-    #             yPos -= 2 * self.vars["height"]
-    #         yPos = abs(yPos)
-    #
-    #     return int(yPos)
-    #
-    #
-    # # Determine which WALL the foosball will hit next
-    # # We use linear interpolation, along with the latest coordinates, to calculate this
-    # def _getIntersectingWallPosition(self):
-    #
-    #     # Calculate latest two coordinates for interpolation
-    #     x2 = self.ballPositions[-1:][0][0]
-    #     y2 = self.ballPositions[-1:][0][1]
-    #     x1 = x2 - self.deltaX
-    #     y1 = y2 - self.deltaY
-    #
-    #     # The ball is heading towards our goal (LEFT)
-    #     if self.deltaX < 0:
-    #         wallX = 0
-    #         wallY = self._interpolate(wallX, x2, y2, x1, y1)
-    #         if wallY >= 0 and wallY <= self.vars["height"]:
-    #             self.projectedWallPosition = (wallX, int(wallY))
-    #             if self.debug:
-    #                 self.log("[DEBUG] Projected wall intersection is LEFT wall at coordinates: {}".format(self.projectedWallPosition))
-    #
-    #     # The ball is heading towards our opponent's goal (RIGHT)
-    #     elif self.deltaX > 0:
-    #         wallX = self.vars["width"]
-    #         wallY = self._interpolate(wallX, x2, y2, x1, y1)
-    #         if wallY >= 0 and wallY <= self.vars["height"]:
-    #             self.projectedWallPosition = (wallX, int(wallY))
-    #             if self.debug:
-    #                 self.log("[DEBUG] Projected wall intersection is RIGHT wall at coordinates: {}".format(self.projectedWallPosition))
-    #
-    #     # The ball is heading towards our side (DOWN)
-    #     elif self.deltaY < 0:
-    #         wallY = 0
-    #         wallX = self._interpolate(wallY, y2, x2, y1, x1)
-    #         if wallX >= 0 and wallX <= self.vars["width"]:
-    #             self.projectedWallPosition = (int(wallX), wallY)
-    #             if self.debug:
-    #                 self.log("[DEBUG] Projected wall intersection is BOTTOM wall at coordinates: {}".format(self.projectedWallPosition))
-    #
-    #     # The ball is heading towards our opponent's side (UP)
-    #     elif self.deltaY > 0:
-    #         wallY = self.vars["height"]
-    #         wallX = self._interpolate(wallY, y2, x2, y1, x1)
-    #         if wallX >= 0 and wallX <= self.vars["width"]:
-    #             self.projectedWallPosition = (int(wallX), wallY)
-    #             if self.debug:
-    #                 self.log("[DEBUG] Projected wall intersection is TOP wall at coordinates: {}".format(self.projectedWallPosition))
-    #
-    #     # The ball is not moving
-    #     else:
-    #         self.projectedWallPosition = None
-    #         if self.debug:
-    #             self.log("[DEBUG] No projected wall intersection, the ball is not currently moving")
-    #
-    #
-    # # We use linear interpolation between two points (x1, y1) and (x2, y2)
-    # # to determine the future intersection point (xi, yi) for a fixed xi
-    # def _interpolate(self, xi, x2, y2, x1, y1):
-    #     return (xi - x1) * (y2 - y1) / (x2 - x1) + y1
+    # Get a color mask of the foosmen of each player in `modes` (RED and/or BLUE), stacked from top to bottom,
+    # and a second buffer of the same size for filtering it
+    # The masks are `playerMaskGap` rows apart, and those rows are set, so erosions treat them like the frame's edge
+    # Both are reused between frames
+    # Returns the two buffers, and the first row of each player's mask
+    def _getPlayerMasks(self, modes):
+        height, width = self.vars["height"], self.vars["width"]
+        offsets = [i * (height + self.playerMaskGap) for i in range(len(modes))]
+        if modes not in self.playerMasks:
+            shape = (offsets[-1] + height, width)
+            self.playerMasks[modes] = (np.full(shape, 255, dtype="uint8"), np.empty(shape, dtype="uint8"))
+        mask, opened = self.playerMasks[modes]
+
+        # The whole frame is blurred and labeled once and shared by all detectors
+        self._preprocess()
+        for mode, y0 in zip(modes, offsets):
+            if self.vars["colorLUT"]:
+                cv2.bitwise_and(self.labels, self.colorLUT.getLabel(mode), dst=mask[y0:y0 + height])
+            else:
+                np.copyto(mask[y0:y0 + height], self._getHSVMask(self.hsv, mode))
+        return mask, opened, offsets
+
+
+    # Find blobs of connected non-zero pixels in a mask, with either backend (see `blobDetector`)
+    # `offset` (x, y) is added to blob coordinates, ie for masks of a window of the table frame
+    # Returns a structured array with one entry per blob (see BLOB_DTYPE)
+    def _getBlobs(self, mask, offset=(0, 0)):
+        if self.vars["blobDetector"] == "contours":
+            return self._getContourBlobs(mask, offset)
+
+        # Label 0 is the background
+        # With 8-connectivity, a 640x360 mask has fewer than 65536 blobs, so 16-bit labels are enough (and faster)
+        n, labels, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity=8, ltype=cv2.CV_16U)
+        blobs = np.empty(n - 1, dtype=BLOB_DTYPE)
+        blobs["x"] = stats[1:, cv2.CC_STAT_LEFT] + offset[0]
+        blobs["y"] = stats[1:, cv2.CC_STAT_TOP] + offset[1]
+        blobs["w"] = stats[1:, cv2.CC_STAT_WIDTH]
+        blobs["h"] = stats[1:, cv2.CC_STAT_HEIGHT]
+        blobs["area"] = stats[1:, cv2.CC_STAT_AREA]
+        blobs["cx"] = centroids[1:, 0] + offset[0]
+        blobs["cy"] = centroids[1:, 1] + offset[1]
+        return blobs
+
+
+    # Find blobs from the outer contours of a mask
+    # Areas and centroids are those of the contour polygons, which can differ slightly from the pixels'
+    def _getContourBlobs(self, mask, offset=(0, 0)):
+        contours = self._getContours(mask, offset)
+        blobs = np.empty(len(contours), dtype=BLOB_DTYPE)
+        for i, c in enumerate(contours):
+            x, y, w, h = cv2.boundingRect(c)
+            M = cv2.moments(c)
+            if M["m00"] > 0:
+                cx, cy = M["m10"] / M["m00"], M["m01"] / M["m00"]
+            else:
+                cx, cy = x + (w - 1) / 2, y + (h - 1) / 2
+            blobs[i] = (x, y, w, h, M["m00"], cx, cy)
+        return blobs
+
+
+    # Fill the pixels of a mask of a window (x0, y0, x1, y1) of the table frame (or the whole frame) on the output image
+    # If `blob` is given, only fill the pixels inside its bounding rectangle
+    def _drawBlobs(self, mask, window, color, blob=None):
+        if not self.render:
+            return
+        x0, y0 = window[:2] if window is not None else (0, 0)
+        if blob is not None:
+            x, y, w, h = int(blob["x"]), int(blob["y"]), int(blob["w"]), int(blob["h"])
+            mask = mask[y - y0:y - y0 + h, x - x0:x - x0 + w]
+            x0, y0 = x, y
+        h, w = mask.shape[:2]
+
+        # Copy from a frame filled with the color (one per color, kept between frames), which is much faster than indexing
+        if color not in self.blobColors:
+            self.blobColors[color] = np.full((self.vars["height"], self.vars["width"], 3), color, dtype="uint8")
+        cv2.copyTo(self.blobColors[color][:h, :w], mask, self.outputImg[y0:y0 + h, x0:x0 + w])
+
+
+    # Get foosball blobs within a window (x0, y0, x1, y1) of the table frame
+    # Returns the blobs, and the mask they were found in
+    def _getBallBlobs(self, window):
+        x0, y0, x1, y1 = window
+
+        # Create mask and perform morphological "opening" to remove small blobs in mask.
+        # Opening erodes an image and then dilates the eroded image, using the same structuring
+        # element for both operations. This is useful for removing small objects from an image
+        # while preserving the shape and size of larger objects in the image.
+        mask = self._getColorMask("ball", window)
+        mask = cv2.erode(mask, None, iterations=2)
+        mask = cv2.dilate(mask, None, iterations=2)
+
+        return self._getBlobs(mask, (x0, y0)), mask
+
+
+    # Find foosball candidates on a downscaled copy of the table frame, which is several times cheaper to search
+    # Each pyramid level blurs and halves the frame (cv2.pyrDown), which also takes the place of the full resolution blur
+    # Returns a full resolution window (x0, y0, x1, y1) around the largest candidate, or None if there are none
+    def _findCoarseBall(self):
+        levels = self.vars["ballPyramidLevels"]
+        scale = 2 ** levels
+        small = self.frame
+        for i in range(levels):
+            small = cv2.pyrDown(small)
+
+        # The foosball is 18 px wide, so it survives an opening at half resolution, but not at a quarter
+        mask = self._getImageColorMask(small, "ball")
+        iterations = max(2 - levels, 0)
+        if iterations > 0:
+            mask = cv2.erode(mask, None, iterations=iterations)
+            mask = cv2.dilate(mask, None, iterations=iterations)
+
+        blobs = self._getBlobs(mask)
+        if len(blobs) == 0:
+            return None
+
+        # Search around the largest candidate, with enough margin for the full foosball and rounding
+        x, y, w, h = (int(v) for v in blobs[np.argmax(blobs["area"])][["x", "y", "w", "h"]])
+        margin = self.vars["foosballWidth"] // 2 + scale
+        x0 = max(x * scale - margin, 0)
+        y0 = max(y * scale - margin, 0)
+        x1 = min((x + w) * scale + margin, self.vars["width"])
+        y1 = min((y + h) * scale + margin, self.vars["height"])
+        return (x0, y0, x1, y1)
+
+
+    # Get the window (x0, y0, x1, y1) to search for the foosball, centered on its projected position
+    # The window grows with the current velocity, so that fast moving shots stay inside it
+    def _getBallSearchWindow(self):
+        x, y = self.projectedPosition
+        halfWidth = int(self.vars["foosballWidth"] * self.vars["ballSearchMargin"] + abs(self.deltaX) * self.vars["ballSearchVelocityScale"])
+        halfHeight = int(self.vars["foosballWidth"] * self.vars["ballSearchMargin"] + abs(self.deltaY) * self.vars["ballSearchVelocityScale"])
+
+        x0 = min(max(int(x) - halfWidth, 0), self.vars["width"] - 1)
+        y0 = min(max(int(y) - halfHeight, 0), self.vars["height"] - 1)
+        x1 = max(min(int(x) + halfWidth, self.vars["width"]), x0 + 1)
+        y1 = max(min(int(y) + halfHeight, self.vars["height"]), y0 + 1)
+
+        return (x0, y0, x1, y1)
+
+
+    # Blur the current table frame and label the color of each pixel, or convert it to HSV color range
+    # This is shared by findBall() and findPlayers(), so it only runs once per frame
+    def _preprocess(self):
+
+        # Reuse cached labels or HSV image if this frame has already been processed
+        if self.hsvFrameNum == self.numFrames:
+            return
+
+        self.blurred = cv2.GaussianBlur(self.frame, (11, 11), 0, dst=self.blurred)
+        if self.vars["colorLUT"]:
+            self.labels = self._getColorLUT().label(self.blurred, self.labels)
+        else:
+            self.hsv = cv2.cvtColor(self.blurred, cv2.COLOR_BGR2HSV, dst=self.hsv)
+        self.hsvFrameNum = self.numFrames
+
+
+    # Get the HSV ranges of each color class ("ball", "RED", and "BLUE" foosmen)
+    def _getColorRanges(self):
+        return {
+            "ball": [(self.vars["foosballHSVLower"], self.vars["foosballHSVUpper"])],
+            "RED": [(self.vars["foosmenRedHSV1Lower"], self.vars["foosmenRedHSV1Upper"]), (self.vars["foosmenRedHSV2Lower"], self.vars["foosmenRedHSV2Upper"])],
+            "BLUE": [(self.vars["foosmenBlueHSVLower"], self.vars["foosmenBlueHSVUpper"])],
+        }
+
+
+    # Get the color lookup table, loading or building a new one if the HSV ranges changed
+    def _getColorLUT(self):
+        ranges = self._getColorRanges()
+        if self.colorLUT is None or ranges != self.colorLUTRanges:
+            self.colorLUT = ColorLUT(ranges, self.vars["colorLUTCacheDir"])
+            self.colorLUTRanges = ranges
+            startTime = time.perf_counter()
+            cached = self.colorLUT.load()
+            self.log("[INFO] Color lookup table {} in {:.0f} ms".format("loaded" if cached else "built", 1000 * (time.perf_counter() - startTime)))
+        return self.colorLUT
+
+
+    # Get a mask of the pixels of a color class ("ball", "RED", or "BLUE"),
+    # within a window (x0, y0, x1, y1) of the table frame, or the whole frame
+    # Pixels in the mask are non-zero, but not necessarily 255
+    def _getColorMask(self, color, window=None):
+
+        # If the whole frame has not been blurred yet, only blur the window
+        # The window is blurred with enough of the surrounding frame that the result is the same
+        if window is not None and self.hsvFrameNum != self.numFrames:
+            x0, y0, x1, y1 = window
+            pad = 5
+            px0, py0 = max(x0 - pad, 0), max(y0 - pad, 0)
+            px1, py1 = min(x1 + pad, self.vars["width"]), min(y1 + pad, self.vars["height"])
+            blurred = cv2.GaussianBlur(self.frame[py0:py1, px0:px1], (11, 11), 0)
+            return self._getImageColorMask(blurred[y0 - py0:y1 - py0, x0 - px0:x1 - px0], color)
+
+        self._preprocess()
+        x0, y0, x1, y1 = window if window is not None else (0, 0, self.vars["width"], self.vars["height"])
+
+        if self.vars["colorLUT"]:
+            return cv2.bitwise_and(self.labels[y0:y1, x0:x1], self.colorLUT.getLabel(color))
+
+        return self._getHSVMask(self.hsv[y0:y1, x0:x1], color)
+
+
+    # Get a mask of the pixels of a color class in any BGR image
+    def _getImageColorMask(self, bgr, color):
+        if self.vars["colorLUT"]:
+            lut = self._getColorLUT()
+            return cv2.bitwise_and(lut.label(bgr), lut.getLabel(color))
+        return self._getHSVMask(cv2.cvtColor(bgr, cv2.COLOR_BGR2HSV), color)
+
+
+    # Get a mask of the pixels of an HSV image within any of the HSV ranges of a color class
+    def _getHSVMask(self, hsv, color):
+        mask = None
+        for lower, upper in self._getColorRanges()[color]:
+            inRange = cv2.inRange(hsv, lower, upper)
+            mask = inRange if mask is None else cv2.bitwise_or(mask, inRange)
+        return mask
+
+
+    # Get the y-coordinate and time until arrival (in seconds) at which the foosball will cross each foosmen rod
+    # This accounts for any number of bounces off the top and bottom walls
+    # `rows` is a list of foosmen rods (default is all 8), and both arrays are returned in the same order
+    # Rods that the foosball is moving away from are NaN
+    def getRodIntercepts(self, rows=None, t=0):
+        rodX = self.vars["rowPosition"] if rows is None else [self.vars["rowPosition"][row] for row in rows]
+        pos, vel, cov = self.predict(t)
+        if pos is None:
+            return np.full(len(rodX), np.nan), np.full(len(rodX), np.nan)
+        return trajectory.getRodIntercepts(pos, vel, rodX, self.vars["height"], self.vars["foosballWidth"] / 2)
+
+
+    # Determine intersecting y-coordinate based on x-coordinate
+    def getIntersectingYPos(self, xPos):
+        pos, vel, cov = self.predict()
+        if pos is None:
+            return None
+        y, t = trajectory.getRodIntercepts(pos, vel, [xPos], self.vars["height"], self.vars["foosballWidth"] / 2)
+        return None if np.isnan(y[0]) else int(y[0])
 
 
     # Print output message to console
+    # The buffer is swapped for an empty one under the lock, so no message from another thread is lost
     def log(self, msg, flush=False):
-        self.msgs.append(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f") + " " + msg)
-        if flush:
-            print("\n".join(self.msgs))
+        msg = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f") + " " + msg
+        with self.msgsLock:
+            self.msgs.append(msg)
+            if not flush:
+                return
+            msgs = self.msgs
             self.msgs = []
+        print("\n".join(msgs))
 
 
     # Save new frame and update FPS data
-    def readFrame(self, frame):
+    # `timestamp` is when the frame was captured (time.perf_counter(), as returned by videoStream.read())
+    # Frames are timed when they are read if no timestamp is given
+    # `format` is "bgr", or "yuv" for YUV420 frames (see videoStream)
+    def readFrame(self, frame, timestamp=None, format="bgr"):
         if self.debug:
             self.log("[DEBUG] Read frame begin")
 
         self.rawFrame = frame
+        self.rawFormat = format
+
+        # Time since the previous frame is used for motion, so it must come from when frames were captured
+        if timestamp is None:
+            timestamp = time.perf_counter()
+        if self.frameTimestamp is not None and timestamp > self.frameTimestamp:
+            self.frameTime = timestamp - self.frameTimestamp
+        self.frameTimestamp = timestamp
 
         # Calculate updated FPS
         self.numFrames += 1
         self.currentTime = datetime.datetime.now()
-        self.elapsedTime = (self.currentTime - self.startTime).total_seconds()
-        self.fps = self.numFrames / self.elapsedTime
+        self.elapsedTime = timestamp - self.startClock
+        self.fps = self.numFrames / self.elapsedTime if self.elapsedTime > 0 else None
 
         if self.debug:
             self.log("[DEBUG] Read frame end")
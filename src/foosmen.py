@@ -7,14 +7,20 @@
 # https://www.instructables.com/Raspberry-Pi-Python-and-a-TB6600-Stepper-Motor-Dri/
 
 # Import packages
-import RPi.GPIO as io
-import time
+import numpy as np
+from threading import Lock
+from profiles import MotionProfile
+from pulses import GPIOPulses
 
 
 class Foosmen:
 
     # Initialize foosmen row
-    def __init__(self, id, numPlayers, xPos, playerSpacing, maxLinearMovement, linearIO, rotationalIO):
+    # `pulses` generates the step pulses (see pulses.py), and defaults to RPi.GPIO
+    # `linearProfile` and `rotationalProfile` plan acceleration for each motor (see profiles.py)
+    # `firstPlayerY` and `direction` calibrate the row to the camera (see RodTracker), and depend on how the rod is mounted
+    # and how its motor is wired. Rows without `firstPlayerY` are not re-zeroed from the camera.
+    def __init__(self, id, numPlayers, xPos, playerSpacing, maxLinearMovement, linearIO, rotationalIO, pulses=None, linearProfile=None, rotationalProfile=None, firstPlayerY=None, direction=1):
 
         # The ID of each foosmen row goes from left to right (0-7)
         self.id = id
@@ -34,9 +40,16 @@ class Foosmen:
         # The spanning distance (linear movement) that each player can move (in pixels)
         self.maxPosition = maxLinearMovement
 
+        # The y-coordinate (in pixels) of the first foosman's center at position 0, and whether the foosmen move
+        # down (1) or up (-1) the camera frame as position increases
+        self.firstPlayerY = firstPlayerY
+        self.direction = direction
+
         # The current position (linear movement)
         # 0 = all the way towards the side with the motors
+        # Moves update it from the row's executor thread and correct() from the strategy thread, so both hold the lock
         self.position = 0
+        self.positionLock = Lock()
 
         # Both motors exist and initialized
         self.linearMotorExists = False
@@ -55,14 +68,26 @@ class Foosmen:
         # This ensure continuous movement and effectively sets the rotation speed of the motor
         self.delay = .0022
 
+        # Each move starts at the speed set by `delay` (which is known not to skip steps),
+        # accelerates up to a maximum speed, then decelerates back down before stopping
+        # Speeds are in steps/s and acceleration is in steps/s^2
+        if linearProfile is None:
+            linearProfile = MotionProfile(1 / (2 * self.delay), 600, 4000)
+        if rotationalProfile is None:
+            rotationalProfile = MotionProfile(1 / (2 * self.delay), 800, 8000)
+        self.linearProfile = linearProfile
+        self.rotationalProfile = rotationalProfile
+
+        # Coordinated moves (both motors at once) are cached by number of steps on each motor
+        self.coordinatedMoves = {}
+
 
         ##########################################################################
         # Initialize linear and rotational motors                                #
         ##########################################################################
 
-        # Use broadcom pin-numbering scheme for GPIO pins
-        # These pin numbers follow the lower-level numbering system defined by the Raspberry Pi's Broadcom-chip brain
-        io.setmode(io.BCM)
+        # Step pulse generator, which also sets up and writes GPIO pins
+        self.pulses = pulses if pulses is not None else GPIOPulses()
 
 
         # Linear Motion
@@ -71,15 +96,15 @@ class Foosmen:
 
             # Pulse/Step
             self.linearPUL = linearIO[0]
-            io.setup(self.linearPUL, io.OUT)
+            self.pulses.setup(self.linearPUL)
 
             # Direction
             self.linearDIR = linearIO[1]
-            io.setup(self.linearDIR, io.OUT)
+            self.pulses.setup(self.linearDIR)
 
             # Enable
             self.linearENA = linearIO[2]
-            io.setup(self.linearENA, io.OUT)
+            self.pulses.setup(self.linearENA)
 
             self.linearMotorExists = True
 
@@ -90,15 +115,15 @@ class Foosmen:
 
             # Pulse/Step
             self.rotationalPUL = rotationalIO[0]
-            io.setup(self.rotationalPUL, io.OUT)
+            self.pulses.setup(self.rotationalPUL)
 
             # Direction
             self.rotationalDIR = rotationalIO[1]
-            io.setup(self.rotationalDIR, io.OUT)
+            self.pulses.setup(self.rotationalDIR)
 
             # Enable
             self.rotationalENA = rotationalIO[2]
-            io.setup(self.rotationalENA, io.OUT)
+            self.pulses.setup(self.rotationalENA)
 
             self.rotationalMotorExists = True
 
@@ -109,16 +134,16 @@ class Foosmen:
         # Linear motor
         if self.linearMotorExists:
             # Set direction
-            io.output(self.linearDIR, 1)
+            self.pulses.output(self.linearDIR, 1)
             # Send power
-            io.output(self.linearENA, 0)
+            self.pulses.output(self.linearENA, 0)
 
         # Rotational motor
         if self.rotationalMotorExists:
             # Set direction
-            io.output(self.rotationalDIR, 1)
+            self.pulses.output(self.rotationalDIR, 1)
             # Send power
-            io.output(self.rotationalENA, 0)
+            self.pulses.output(self.rotationalENA, 0)
 
         return self
 
@@ -126,24 +151,34 @@ class Foosmen:
     # Stop motors
     def stop(self):
         if self.linearMotorExists:
-            io.output(self.linearENA, 1)
+            self.pulses.output(self.linearENA, 1)
         if self.rotationalMotorExists:
-            io.output(self.rotationalENA, 1)
+            self.pulses.output(self.rotationalENA, 1)
 
 
     # Kick foosmen row (rotational motion)
-    def kick(self):
+    # If `cancel` is given (a threading.Event), the kick stops early once it is set
+    def kick(self, cancel=None):
 
         # Ensure motor exists
         if not self.rotationalMotorExists:
             return
 
-        #io.output(self.rotationalDIR, 1)
-        for x in range(self.stepsPerRevolution):
-            io.output(self.rotationalPUL, 1)
-            time.sleep(self.delay)
-            io.output(self.rotationalPUL, 0)
-            time.sleep(self.delay)
+        #self.pulses.output(self.rotationalDIR, 1)
+        self.pulses.pulse([(self.rotationalPUL, self.rotationalProfile.getDelays(self.stepsPerRevolution))], cancel)
+
+
+    # Correct the current position (linear motion), ie from the position measured by the camera
+    def rezero(self, position):
+        with self.positionLock:
+            self.position = min(max(position, 0), self.maxPosition)
+
+
+    # Correct the current position (linear motion) by `offset` pixels, ie the drift measured by the camera
+    # The offset is added with the lock held, so steps counted by a move in the meantime are not overwritten
+    def correct(self, offset):
+        with self.positionLock:
+            self.position = min(max(self.position + offset, 0), self.maxPosition)
 
 
     # Move to center position - this is the default defensive position (linear motion)
@@ -152,7 +187,8 @@ class Foosmen:
 
 
     # Move linear motors to specific position
-    def moveTo(self, pos):
+    # If `cancel` is given (a threading.Event), the move stops early once it is set
+    def moveTo(self, pos, cancel=None):
 
         # Ensure motor exists
         if not self.linearMotorExists:
@@ -160,15 +196,89 @@ class Foosmen:
 
         # Need to move forward
         if (self.position < pos):
-            io.output(self.linearDIR, 1)
+            self.pulses.output(self.linearDIR, 1)
+            direction = 1
         # Need to move backward
         else:
-            io.output(self.linearDIR, 0)
+            self.pulses.output(self.linearDIR, 0)
+            direction = -1
 
         # Calculate number of steps needed and move
-        steps = abs((pos - self.position) / self.pixelsPerStep)
-        for i in range(steps):
-            io.output(self.linearPUL, 1)
-            time.sleep(self.delay)
-            io.output(self.linearPUL, 0)
-            time.sleep(self.delay)
+        # Position is updated with the number of steps actually sent, so it stays correct if the move is interrupted
+        steps = int(round(abs((pos - self.position) / self.pixelsPerStep)))
+        sent = self.pulses.pulse([(self.linearPUL, self.linearProfile.getDelays(steps))], cancel)
+        with self.positionLock:
+            self.position += direction * sent[0] * self.pixelsPerStep
+
+
+    # Move linear motors to specific position while kicking (rotational motion) at the same time
+    # This lets a row slide into the ball as it strikes, for angled shots
+    # If `cancel` is given (a threading.Event), the move stops early once it is set
+    def moveAndKick(self, pos, cancel=None):
+
+        # Without both motors, fall back to whichever motion is possible
+        if not self.linearMotorExists or not self.rotationalMotorExists:
+            self.moveTo(pos, cancel)
+            self.kick(cancel)
+            return
+
+        # Need to move forward
+        if (self.position < pos):
+            self.pulses.output(self.linearDIR, 1)
+            direction = 1
+        # Need to move backward
+        else:
+            self.pulses.output(self.linearDIR, 0)
+            direction = -1
+
+        # Send both pulse trains on the same timeline
+        steps = int(round(abs((pos - self.position) / self.pixelsPerStep)))
+        linear, rotational = self._planCoordinatedMove(steps, self.stepsPerRevolution)
+        sent = self.pulses.pulse([(self.linearPUL,) + linear, (self.rotationalPUL,) + rotational], cancel)
+        with self.positionLock:
+            self.position += direction * sent[0] * self.pixelsPerStep
+
+
+    # Plan a move of both motors at once, so they start and finish together
+    # The motor with more steps sets the pace, using its motion profile, and the other motor's steps are
+    # spread evenly across it using Bresenham's line algorithm (each minor step lands on a major step)
+    # If that would drive the other motor past its own maximum speed or acceleration, both motors are slowed down
+    # Returns (delays, starts) for the linear motor and for the rotational motor
+    def _planCoordinatedMove(self, linearSteps, rotationalSteps):
+        key = (linearSteps, rotationalSteps)
+        if key in self.coordinatedMoves:
+            return self.coordinatedMoves[key]
+
+        if linearSteps >= rotationalSteps:
+            majorSteps, minorSteps, profile = linearSteps, rotationalSteps, self.linearProfile
+            minorProfile = self.rotationalProfile
+        else:
+            majorSteps, minorSteps, profile = rotationalSteps, linearSteps, self.rotationalProfile
+            minorProfile = self.linearProfile
+
+        # Timeline of the major motor, with each pulse starting as soon as the previous one ends
+        delays = profile.getDelays(majorSteps)
+        starts = np.concatenate(([0], np.cumsum(2 * delays)[:-1])) if majorSteps > 0 else np.zeros(0)
+
+        # Bresenham's line algorithm, vectorized: step the minor motor on the nearest major step
+        # to each of its evenly spaced ideal positions
+        steps = ((np.arange(minorSteps) + 0.5) * majorSteps / max(minorSteps, 1)).astype("int")
+
+        # The minor motor follows the major motor's timeline, so slow the whole timeline down until the minor motor
+        # stays within its own profile: no step closer to the last than its maximum speed allows, and no more than
+        # its acceleration (the major motor's, scaled by the ratio of steps, and divided by the square of the stretch)
+        stretch = 1.0
+        if minorSteps > 1:
+            stretch = max(stretch, 1 / (minorProfile.maxSpeed * np.diff(starts[steps]).min()))
+        if minorSteps > 0 and minorProfile.acceleration > 0:
+            stretch = max(stretch, np.sqrt(profile.acceleration * minorSteps / majorSteps / minorProfile.acceleration))
+        if stretch > 1:
+            delays = delays * stretch
+            starts = starts * stretch
+
+        major = (delays, starts)
+        minor = (delays[steps], starts[steps])
+
+        plan = (major, minor) if linearSteps >= rotationalSteps else (minor, major)
+        self.coordinatedMoves[key] = plan
+        return plan
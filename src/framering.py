@@ -0,0 +1,103 @@
+#########################
+# Automated Foosball    #
+#########################
+
+# This class is a fixed set of preallocated frame buffers shared by a capture thread and a consumer
+# The capture thread fills a buffer in place and publishes it, and the consumer takes the newest published
+# frame. A frame that has been taken belongs to the consumer until it is released, and is never written to
+# in the meantime, so frames do not have to be copied or reallocated as they are handed over.
+#
+# Each buffer is in one of these states:
+#   filling   - being written by the capture thread (always exactly one)
+#   published - the newest captured frame, not taken yet (at most one)
+#   held      - taken by the consumer and not released yet
+#   free      - available to be filled next
+# Needs at least 2 more buffers than the number of frames the consumer holds at once.
+
+# import the necessary packages
+from threading import Condition
+
+import numpy as np
+
+
+class FrameRing:
+
+    # Initialize `size` buffers for frames with the given shape (ie (height, width, 3))
+    def __init__(self, shape, size=5, dtype="uint8"):
+
+        self.buffers = [np.empty(shape, dtype=dtype) for i in range(size)]
+        self.indexes = {id(buffer): i for i, buffer in enumerate(self.buffers)}
+
+        self.filling = 0
+        self.published = None
+        self.held = set()
+        self.free = list(range(1, size))
+
+        self.condition = Condition()
+        self.closed = False
+
+        # Frames captured but never taken, because a newer frame replaced them (dropped),
+        # or because every buffer was in use and there was nowhere to put them (overruns)
+        self.dropped = 0
+        self.overruns = 0
+
+
+    # Get the buffer the capture thread should fill next
+    def getBuffer(self):
+        return self.buffers[self.filling]
+
+
+    # Publish the filled buffer as the newest frame, and move on to a free buffer
+    # A published frame that was never taken is dropped and its buffer reused
+    # Returns False if every other buffer is in use, in which case the frame is dropped and the buffer refilled
+    def publish(self, seq, timestamp):
+        with self.condition:
+            if self.published is not None:
+                self.free.append(self.published[0])
+                self.dropped += 1
+            elif len(self.free) == 0:
+                self.overruns += 1
+                return False
+
+            self.published = (self.filling, seq, timestamp)
+            self.filling = self.free.pop(0)
+            self.condition.notify_all()
+            return True
+
+
+    # Take the newest published frame
+    # If `wait` is True, block until one is published, or until `timeout` (in seconds)
+    # Returns (frame, seq, timestamp), or None if there is no new frame
+    def take(self, wait=False, timeout=None):
+        with self.condition:
+            if wait:
+                self.condition.wait_for(lambda: self.published is not None or self.closed, timeout)
+            if self.published is None:
+                return None
+
+            index, seq, timestamp = self.published
+            self.published = None
+            self.held.add(index)
+            return self.buffers[index], seq, timestamp
+
+
+    # Give a frame returned by take() back, so its buffer can be filled again
+    # Views of the frame (ie frame[...]) are resolved to the buffer they share memory with
+    # Raises ValueError for a frame that is not one of the buffers, ie a copy, since its buffer would never be freed
+    def release(self, frame):
+        index = self.indexes.get(id(frame))
+        if index is None:
+            index = next((i for i, buffer in enumerate(self.buffers) if np.may_share_memory(frame, buffer)), None)
+            if index is None:
+                raise ValueError("Released frame is not a buffer of this FrameRing (or a view of one)")
+        with self.condition:
+            if index in self.held:
+                self.held.remove(index)
+                self.free.append(index)
+
+
+    # Wake up a consumer waiting for a frame, so it can stop
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
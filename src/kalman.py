@@ -0,0 +1,117 @@
+#########################
+# Automated Foosball    #
+#########################
+
+# This class estimates the position and velocity of the foosball using a Kalman filter
+# It uses a constant velocity motion model (or optionally constant acceleration) in table pixels,
+# which smooths noisy detections and continues to predict the ball position while it is occluded
+# https://en.wikipedia.org/wiki/Kalman_filter
+
+# import the necessary packages
+import numpy as np
+
+
+class BallFilter:
+
+    # Initialize filter
+    # `processNoise` is the standard deviation of unmodeled acceleration (or jerk), in pixels/s^2 (or pixels/s^3)
+    # `measurementNoise` is the standard deviation of each detected foosball position, in pixels
+    def __init__(self, acceleration=False, processNoise=1500.0, measurementNoise=2.0, initialVelocityNoise=1000.0):
+
+        # The state is [x, y, vx, vy] or [x, y, vx, vy, ax, ay], in pixels and seconds
+        self.acceleration = acceleration
+        self.order = 3 if acceleration else 2
+        self.size = 2 * self.order
+
+        self.processNoise = processNoise
+        self.measurementNoise = measurementNoise
+        self.initialVelocityNoise = initialVelocityNoise
+
+        # Measurements only observe position
+        self.H = np.zeros((2, self.size))
+        self.H[0, 0] = 1
+        self.H[1, 1] = 1
+        self.R = np.eye(2) * measurementNoise ** 2
+
+        self.reset()
+
+
+    # Clear state, so the next measurement starts a new track
+    def reset(self):
+        self.state = None
+        self.covariance = None
+        self.time = None
+
+
+    # Return True once the filter has received at least one measurement
+    def isInitialized(self):
+        return self.state is not None
+
+
+    # State transition (F) and process noise (Q) matrices for a time step of `dt` seconds
+    def _model(self, dt):
+
+        # Each derivative integrates into the one below it, ie x += vx * dt + ax * dt^2 / 2
+        # Noise enters through the highest derivative, and is propagated down the same way
+        terms = [1, dt, dt * dt / 2]
+        F = np.eye(self.size)
+        G = np.zeros((self.size, 1))
+        for i in range(self.order):
+            for j in range(i + 1, self.order):
+                F[2 * i, 2 * j] = terms[j - i]
+                F[2 * i + 1, 2 * j + 1] = terms[j - i]
+            G[2 * i, 0] = [dt * dt * dt / 6, dt * dt / 2, dt][3 - self.order + i]
+
+        # Noise is independent along each axis
+        q = np.dot(G[0::2], G[0::2].T) * self.processNoise ** 2
+        Q = np.zeros((self.size, self.size))
+        Q[0::2, 0::2] = q
+        Q[1::2, 1::2] = q
+
+        return F, Q
+
+
+    # Propagate state and covariance from the last update to time `t` (in seconds)
+    def _propagate(self, t):
+        dt = max(t - self.time, 0)
+        F, Q = self._model(dt)
+        state = np.dot(F, self.state)
+        covariance = np.dot(np.dot(F, self.covariance), F.T) + Q
+        return state, covariance
+
+
+    # Add a detected foosball position (x, y) at time `t` (in seconds)
+    def update(self, pos, t):
+        z = np.array(pos, dtype="float64")
+
+        # Start a new track at the detected position with unknown velocity
+        if self.state is None:
+            self.state = np.zeros(self.size)
+            self.state[0:2] = z
+            self.covariance = np.eye(self.size) * self.initialVelocityNoise ** 2
+            self.covariance[0:2, 0:2] = self.R
+            self.time = t
+            return
+
+        # Predict to the time of this measurement, then correct using the measurement
+        state, covariance = self._propagate(t)
+        residual = z - np.dot(self.H, state)
+        S = np.dot(np.dot(self.H, covariance), self.H.T) + self.R
+        K = np.dot(np.dot(covariance, self.H.T), np.linalg.inv(S))
+        self.state = state + np.dot(K, residual)
+        self.covariance = np.dot(np.eye(self.size) - np.dot(K, self.H), covariance)
+        self.time = t
+
+
+    # Predict position (x, y), velocity (vx, vy), and position covariance at time `t` (in seconds)
+    # This does not change the filter state, so it can be called for any number of future times
+    def predict(self, t):
+        if self.state is None:
+            return None, None, None
+        state, covariance = self._propagate(t)
+        return (state[0], state[1]), (state[2], state[3]), covariance[0:2, 0:2]
+
+
+    # Current velocity (vx, vy), in pixels/s
+    def velocity(self):
+        return (self.state[2], self.state[3]) if self.state is not None else None
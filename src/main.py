@@ -6,15 +6,18 @@
 # python main.py
 # python main.py --debug
 # python main.py --output output.mp4
+# python main.py --input output.mp4
 
 # import the necessary packages
 import argparse
 import cv2
 import math
 import time
-from camera import videoStream
+from executor import MotorExecutor
 from foosball import Foosball
 from foosmen import Foosmen
+from pipeline import Pipeline
+from rodtracker import RodTracker
 
 print("Starting Main Script")
 
@@ -25,6 +28,10 @@ ap.add_argument("--debug", help="whether or not to show debug mode", action="sto
 ap.add_argument("--nopreview", help="whether or not to hide video preview", action="store_true")
 ap.add_argument("--raw", help="whether or not to show raw video capture", action="store_true")
 ap.add_argument("--output", help="path to output video file")
+ap.add_argument("--input", help="path to recorded video file or directory of PNG images to replay instead of the camera")
+ap.add_argument("--loop", help="whether or not to loop the recorded input", action="store_true")
+ap.add_argument("--pigpio", help="whether or not to generate motor step pulses with pigpio waveforms", action="store_true")
+ap.add_argument("--yuv", help="whether or not to capture YUV420 frames, and only convert the table to color", action="store_true")
 args = vars(ap.parse_args())
 
 # Show preview
@@ -36,9 +43,17 @@ showPreview = not args["nopreview"]
 ##########################################################################
 
 # Initialize camera and allow time to warm up
-print("Initialize camera")
-vs = videoStream().start()
-time.sleep(2.0)
+# If a recorded session is given, replay it at the recorded FPS instead
+frameFormat = "yuv" if args["yuv"] else "bgr"
+if args["input"]:
+	print("Initialize replay: {}".format(args["input"]))
+	from replay import replayStream
+	vs = replayStream(args["input"], loop=args["loop"], format=frameFormat).start()
+else:
+	print("Initialize camera")
+	from camera import videoStream
+	vs = videoStream(format=frameFormat).start()
+	time.sleep(2.0)
 
 # Initialize foosball game
 print("Initialize game")
@@ -47,20 +62,39 @@ fb = Foosball(args["debug"]).start()
 # Initialize players and motors
 print("Initialize players and motors")
 
+# Motor step pulses are timed by pigpio (DMA hardware) if requested, otherwise by RPi.GPIO
+if args["pigpio"]:
+	from pulses import PigpioPulses
+	pulses = PigpioPulses()
+else:
+	from pulses import GPIOPulses
+	pulses = GPIOPulses()
+
+# Each row is calibrated to the camera with the y-coordinate of its first foosman at position 0, and the direction its
+# foosmen move in the frame as position increases. These depend on how each rod is mounted and its motor is wired,
+# so measure them (ie move the row to position 0 and read the detected foosmen) whenever a rod or motor is changed.
+# Until measured, the y-coordinates below assume each row's range of movement is centered on the table.
+
 # The goalie row (0) has 3 men, located at xPos 29, spaced 7 1/8" apart, and 8 1/2" of linear movement
-row0 = Foosmen(0, 3, 29, 97.54, 116.37, None, None).start()
+row0 = Foosmen(0, 3, 29, 97.54, 116.37, None, None, pulses, firstPlayerY=24, direction=1).start()
 
 # The defense row (1) has 2 men, located at xPos 114, spaced 9 5/8" apart, and 13 3/8" of linear movement
-row1 = Foosmen(1, 2, 114, 131.77, 183.11, None, None).start()
+row1 = Foosmen(1, 2, 114, 131.77, 183.11, None, None, pulses, firstPlayerY=23, direction=1).start()
 
 # The midfield row (3) has 5 men, located at xPos 280, spaced 5" apart, and 4 1/4" of linear movement
-row3 = Foosmen(3, 5, 280, 68.45, 58.18, None, (17, 27, 22)).start()
+row3 = Foosmen(3, 5, 280, 68.45, 58.18, None, (17, 27, 22), pulses, firstPlayerY=14, direction=1).start()
 
 # The offense row (5) has 3 men, located at xPos 443, spaced 7 1/8" apart, and 8 1/2" of linear movement
-row5 = Foosmen(5, 3, 443, 97.54, 116.37, None, None).start()
+row5 = Foosmen(5, 3, 443, 97.54, 116.37, None, None, pulses, firstPlayerY=24, direction=1).start()
 
 players = [row0, row1, None, row3, None, row5, None, None]
 
+# Each row of players executes motor commands on its own thread, so the main loop never blocks
+executors = [MotorExecutor(row).start() if row is not None else None for row in players]
+
+# Each row of players is re-zeroed using the position of its foosmen detected by the camera, if it is calibrated
+trackers = [RodTracker(row, row.firstPlayerY, row.direction) if row is not None and row.firstPlayerY is not None else None for row in players]
+
 
 # # Calculate the lower and upper bounds for each foosmen
 # 'foosmen': np.array([
@@ -102,103 +136,44 @@ if args["output"]:
 	writer = cv2.VideoWriter(args["output"], fourcc, 30, (fb.vars["outputWidth"], fb.vars["outputHeight"]), True)
 
 
-# Main loop
-while fb.gameIsActive:
-	print()
-	fb.log("[INFO] Main loop begin")
-
-
-	##########################################################################
-	# This section grabs the latest image from the camera stream             #
-	# and detects the table, players, and ball                               #
-	##########################################################################
-
-	# Read frame from camera stream and update FPS counter
-	rawFrame = vs.read()
-	fb.readFrame(rawFrame)
-
-	# Because the camera or table can move during play, we place ArUco markers
-	# in each corner of the foosball table and then detect them in real time.
-	# This allows us to effectively place "boundary points" in each corner and
-	# then crop our live stream to these specific points.
-	fb.findTable()
-
-	# Find goal and display overlay
-	fb.findGoal()
-
-	# Find location of the foosball
-	fb.findBall()
-
-	# Find location of the players
-	fb.findPlayers("RED")
-	fb.findPlayers("BLUE", True)
-
-
-	##########################################################################
-	# Display to screen and record video output                              #
-	##########################################################################
-
-	# Display original (uncropped) image and transformation coordinates
-	if args["raw"]:
-		origImg = fb.rawFrame.copy()
-		#if fb.tableCoords is not None:
-			#origCoords = np.array(fb.tableCoords, dtype="float32")
-			#for (x, y) in origCoords:
-			#for (x, y) in fb.tableCoords:
-				#cv2.circle(origImg, (int(float(x)), int(float(y))), 5, (0, 255, 0), -1)
-		cv2.namedWindow("Raw")
-		cv2.moveWindow("Raw", 1250, 100)
-		cv2.imshow("Raw", origImg)
-
-	# Build output frame
-	out = fb.buildOutputFrame()
-
-	# Show on screen
-	if showPreview:
-		cv2.imshow("Output", out)
-
-	# Write frame to output file
-	if writer is not None:
-		writer.write(out)
-
-	# Handle user input. Stop loop if the "q" key is pressed.
-	fb.log("[INFO] Wait for user input", True)
-	key = cv2.waitKey(1) & 0xFF
-	# Quit
-	if key == ord("q"):
-		break
-	# Toggle debug mode
-	elif key == ord("d"):
-		fb.debug = not fb.debug
+##########################################################################
+# Determine how to respond based on current conditions                   #
+##########################################################################
 
+# Decide how each row should respond, based on the game state detected on one frame
+# This runs on the strategy stage of the pipeline, and returns a list of motor commands
+# Each command is (row, method, args), and is sent to that row's MotorExecutor
+def strategy(state):
+	commands = []
 
-	##########################################################################
-	# Determine how to respond based on current conditions                   #
-	##########################################################################
+	# Correct each row's position using the detected players
+	for i, tracker in enumerate(trackers):
+		if tracker is not None and tracker.update(state["playerPositions"][i], executors[i].isBusy()):
+			fb.log("[INFO] Row {} position corrected to {:.1f}".format(i, players[i].position))
 
 	# Ensure foosball position is known
-	if fb.foosballPosition is None:
-		continue
+	if state["foosballPosition"] is None:
+		return commands
 
 	# Current position of foosball
-	currentPosition = fb.ballPositions[-1:][0]
+	currentPosition = state["ballPositions"][-1]
 
 	# Loop through active rows to determine if foosball is within reach
-	for row in players:
+	for i, row in enumerate(players):
 		if row is not None:
 
 			# Kick if foosball is within reach
 			distanceToBall = currentPosition[0] - row.xPos
 			if (distanceToBall < 30):
 				fb.log("[AI] Foosball current xPos: {}".format(currentPosition[0]))
-				fb.log("[AI] Foosmen row {} at xPos {} is within reach of foosball, distance is {}".format(row, row.xPos, distanceToBall))
+				fb.log("[AI] Foosmen row {} at xPos {} is within reach of foosball, distance is {}".format(row.id, row.xPos, distanceToBall))
 				fb.log("[AI] KICK!!!")
-				players[row].kick()
+				commands.append((i, "kick", ()))
 
 
 
 	# # Determine closest row to ball and closest row to future position of ball (next 3 frames)
-	# currentPosition = fb.ballPositions[-1:][0]
+	# currentPosition = state["ballPositions"][-1]
 	# closestRow = fb.getClosestRow(currentPosition[0])
 	# fb.getControllingRow()
 	# projectedRow = fb.getClosestRow(currentPosition[0] + 3 * fb.deltaX)
@@ -232,14 +207,14 @@ while fb.gameIsActive:
 	# 			numFramesNeededToMove = yDistanceNeededToMove // maxYSpeedOfRow
 	# 			if numFramesNeededToMove < numFramesUntilRow:
 	# 				fb.log("[INFO] Row{} move to intercept at {}".format(row, projectedY))
-	# 				players[row].moveTo(projectedY)
+	# 				executors[row].moveTo(projectedY)
 	# 			else:
 	# 				fb.log("[INFO] Row{} not able to intercept at {}, do nothing".format(row, projectedY))
 	#
 	# 		# For rows not in between ball and goal, move to default defensive position.
 	# 		else:
 	# 			fb.log("[INFO] Row{} not in between ball and goal, move to default position".format(row))
-	# 			players[row].center()
+	# 			executors[row].center()
 	#
 	#
 	# # Opponent is in control of ball and the ball is not moving towards our goal
@@ -250,7 +225,7 @@ while fb.gameIsActive:
 	#
 	# 	# Move all rows to default defensive position
 	# 	for row in [0, 1, 3, 5]:
-	# 		players[row].center()
+	# 		executors[row].center()
 	#
 	#
 	# # TODO: build out based on scenario
@@ -269,8 +244,8 @@ while fb.gameIsActive:
 	# 	if fb.projectedPosition[0] >= fb.vars["rowPosition"][fb.controllingRow]:
 	#
 	# 		# Calculate optimal angle between ball and opponent's goal
-	# 		tempX = fb.vars["width"] - fb.ballPositions[-1:][0][0]
-	# 		tempY = fb.vars["height"] / 2 - fb.ballPositions[-1:][0][1]
+	# 		tempX = fb.vars["width"] - state["ballPositions"][-1][0]
+	# 		tempY = fb.vars["height"] / 2 - state["ballPositions"][-1][1]
 	#
 	# 		# Calculate arc tangent (in radians) and convert to degrees
 	# 		angle = math.atan2(tempX, tempY) / math.pi * 180
@@ -300,8 +275,66 @@ while fb.gameIsActive:
 	# 	fb.log("[INFO] Something went wrong... exiting now")
 	# 	fb.gameIsActive = False
 
+	return commands
+
+
+# Send motor commands to each row
+# Executors queue commands on each row's own thread, so this never blocks
+def control(commands):
+	for i, method, args in commands:
+		getattr(executors[i], method)(*args)
+
 
-	fb.log("[INFO] Main loop end", True)
+##########################################################################
+# Capture, vision, strategy, and motor control each run on their own     #
+# thread, always working on the newest frame                             #
+##########################################################################
+
+# The output frame is only built if it will be shown or recorded, and otherwise nothing is drawn at all
+render = showPreview or writer is not None or args["raw"]
+fb.render = render
+pipeline = Pipeline(vs, fb, strategy, control, render, args["raw"]).start()
+
+# Main loop
+# Display to screen and record video output, and handle user input
+while fb.gameIsActive and pipeline.isRunning():
+
+	# Wait for the next output frame
+	out, raw = pipeline.read(0.1)
+	if out is None and render:
+		continue
+
+	# Display original (uncropped) image
+	if args["raw"]:
+		cv2.namedWindow("Raw")
+		cv2.moveWindow("Raw", 1250, 100)
+		cv2.imshow("Raw", raw)
+
+	# Show on screen
+	if showPreview:
+		cv2.imshow("Output", out)
+
+	# Write frame to output file
+	if writer is not None:
+		writer.write(out)
+
+	# Done with the output frame, so it can be reused
+	if out is not None:
+		pipeline.release(out)
+
+	# Handle user input. Stop loop if the "q" key is pressed.
+	# Key presses are read from the preview windows, so there is nothing to read without them
+	if not showPreview and not args["raw"]:
+		continue
+	key = cv2.waitKey(1) & 0xFF
+	# Quit
+	if key == ord("q"):
+		break
+	# Toggle debug mode
+	elif key == ord("d"):
+		fb.debug = not fb.debug
+
+pipeline.stop()
 
 
 # Stop timer and display FPS information
@@ -309,9 +342,21 @@ print()
 print("Ending Main Script")
 print("Elapsed time: {:.2f}".format(fb.elapsedTime))
 print("Avg FPS: {:.2f}".format(fb.fps))
+
+# Display pipeline throughput and latency
+stats = pipeline.getStats()
+print("Frames captured: {}, completed: {}, dropped: {}".format(stats["captured"], stats["completed"], stats["dropped"]))
+for stage in Pipeline.stages[1:] + ["endToEnd"]:
+	if stage in stats:
+		print("{} latency: {:.2f} ms (p50), {:.2f} ms (p95)".format(stage, stats[stage]["p50"], stats[stage]["p95"]))
+print("Frames with players detected: {}, tracked: {}".format(fb.playerDetectionStats["detected"], fb.playerDetectionStats["tracked"]))
 print()
 
-# Release motors
+# Stop motor commands and release motors
+# Each executor waits for the move or kick in progress to stop, so no pulses are sent after the motors are released
+for executor in executors:
+	if executor is not None and not executor.stop():
+		print("[WARNING] Motor commands for a foosmen row did not stop in time")
 for row in players:
 	if row is not None:
 		row.stop()
@@ -319,7 +364,7 @@ for row in players:
 
 # Do a bit of cleanup
 # Reset GPIO, stop camera, video file, and destroy all windows
-io.cleanup()
+pulses.cleanup()
 cv2.destroyAllWindows()
 if writer is not None:
 	writer.release()
@@ -0,0 +1,256 @@
+#########################
+# Automated Foosball    #
+#########################
+
+# This class runs capture, vision, strategy, and motor control as separate stages on their own threads
+# Stages are connected by single-slot queues: a new frame replaces any frame that has not been picked up yet,
+# so a slow stage always works on the newest frame instead of falling behind on stale ones.
+# Each frame is stamped as it leaves every stage, which gives the latency of each stage and the
+# end-to-end "glass to motor" latency from frame capture until motor commands are sent.
+
+# import the necessary packages
+import time
+from collections import deque
+from threading import Condition, Thread
+
+import numpy as np
+
+
+class LatestSlot:
+
+    # Initialize empty slot
+    # `onDrop(item)` is called for every item that is replaced or discarded without being taken
+    def __init__(self, onDrop=None):
+        self.item = None
+        self.condition = Condition()
+        self.closed = False
+        self.dropped = 0
+        self.onDrop = onDrop
+
+
+    # Put an item in the slot, replacing (dropping) any item that has not been taken yet
+    def put(self, item):
+        with self.condition:
+            dropped = self.item
+            if dropped is not None:
+                self.dropped += 1
+            self.item = item
+            self.condition.notify_all()
+        if dropped is not None and self.onDrop is not None:
+            self.onDrop(dropped)
+
+
+    # Take the item from the slot, waiting until one is available
+    # Returns None if the slot is closed, or no item arrives within `timeout` seconds
+    def get(self, timeout=None):
+        with self.condition:
+            self.condition.wait_for(lambda: self.item is not None or self.closed, timeout)
+            item = self.item
+            self.item = None
+            return item
+
+
+    # Wake up any stage waiting on this slot, so it can stop
+    # Any item already in the slot is still handed out, unless `discard` is True
+    def close(self, discard=False):
+        with self.condition:
+            self.closed = True
+            dropped = self.item if discard else None
+            if discard:
+                self.item = None
+            self.condition.notify_all()
+        if dropped is not None and self.onDrop is not None:
+            self.onDrop(dropped)
+
+
+class Pipeline:
+
+    # Stages, in order, each stamping a frame packet when it is done with it
+    stages = ["capture", "vision", "strategy", "control"]
+
+    # Initialize pipeline
+    # `vs` is the frame source (videoStream or replayStream), and `fb` is the Foosball game
+    # `strategy(state)` returns a list of motor commands from the detected game state
+    # `control(commands)` sends motor commands (ie to each row's MotorExecutor), and must not block
+    # If `render` is True, the vision stage also builds the output frame for display
+    # If `raw` is True, a copy of the raw camera frame is displayed along with it
+    def __init__(self, vs, fb, strategy, control, render=True, raw=False):
+
+        self.vs = vs
+        self.fb = fb
+        self.strategy = strategy
+        self.control = control
+        self.render = render
+        self.raw = raw
+
+        # Slots between stages, and for the output frame shown by the main thread
+        # Camera frames are held until vision is done with them, and given back to the camera if dropped
+        # Output frames are held until the main thread releases them, and given back to Foosball if dropped
+        self.visionSlot = LatestSlot(lambda packet: self.vs.release(packet["frame"]))
+        self.strategySlot = LatestSlot()
+        self.controlSlot = LatestSlot()
+        self.displaySlot = LatestSlot(lambda packet: self.fb.releaseOutputFrame(packet["output"]))
+
+        # Timestamps of the most recent frames that made it all the way through the pipeline
+        self.completed = deque(maxlen=10000)
+        self.numCompleted = 0
+        self.captured = 0
+        self.missed = 0
+        self.startTime = None
+        self.stopped = False
+        self.threads = []
+
+
+    # Start a thread for each stage
+    def start(self):
+        self.startTime = time.perf_counter()
+        for target in [self._capture, self._vision, self._strategy, self._control]:
+            t = Thread(target=target, args=())
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+        return self
+
+
+    # Stop all stages
+    def stop(self):
+        self.stopped = True
+        for slot in [self.visionSlot, self.strategySlot, self.controlSlot, self.displaySlot]:
+            slot.close(True)
+        for t in self.threads:
+            t.join(1.0)
+
+
+    # Return True until every stage has finished, ie after the end of a recording
+    def isRunning(self):
+        return any(t.is_alive() for t in self.threads)
+
+
+    # Get the latest output frame to display, and the raw frame if requested, waiting up to `timeout` seconds
+    # Returns (None, None) if no new frame is ready
+    # The output frame is not reused until it is passed to release()
+    def read(self, timeout=None):
+        packet = self.displaySlot.get(timeout)
+        if packet is None:
+            return None, None
+        return packet["output"], packet["raw"]
+
+
+    # Give an output frame returned by read() back, once it has been shown or recorded
+    def release(self, out):
+        self.fb.releaseOutputFrame(out)
+
+
+    # Capture stage: wait for each new frame from the camera or recording
+    # Frames are stamped with the time they were captured, not when they were read
+    def _capture(self):
+        lastSeq = 0
+        while not self.stopped:
+            frame, seq, timestamp = self.vs.read(True, 0.1, True)
+            if frame is None:
+                if self.vs.stopped:
+                    break
+                continue
+
+            # A gap in sequence numbers means the camera captured frames that were never read
+            # Sequence numbers start at 1, so this includes frames captured before the pipeline started (ie during warm-up)
+            if seq > lastSeq + 1:
+                self.missed += seq - lastSeq - 1
+            lastSeq = seq
+
+            self.captured += 1
+            self.visionSlot.put({"frame": frame, "seq": seq, "timestamps": {"capture": timestamp}})
+
+        # The recording ended, so the other stages stop once they are done with the last frame
+        self.visionSlot.close()
+
+
+    # Vision stage: detect the table, ball, and players, and take a snapshot of the game state
+    def _vision(self):
+        fb = self.fb
+        while True:
+            packet = self.visionSlot.get()
+            if packet is None:
+                break
+
+            fb.readFrame(packet["frame"], packet["timestamps"]["capture"], self.vs.format)
+            fb.findTable()
+            fb.findGoal()
+            fb.findBall()
+            fb.trackPlayers("BLUE")
+
+            # Copy the parts of the game state used by strategy, since the next frame will change them
+            packet["state"] = {
+                "foosballPosition": fb.foosballPosition,
+                "projectedPosition": fb.projectedPosition,
+                "ballPositions": list(fb.ballPositions[-2:]),
+                "playerPositions": [np.copy(p) for p in fb.playerPositions],
+                "players": {mode: np.copy(p) for mode, p in fb.players.items()},
+                "opponents": np.copy(fb.opponents),
+                "rodIntercepts": fb.getRodIntercepts(),
+            }
+            packet["timestamps"]["vision"] = time.perf_counter()
+
+            self.strategySlot.put(packet)
+            if self.render:
+                out = fb.buildOutputFrame()
+                if out is not None:
+                    self.displaySlot.put({"output": out, "raw": fb.getRawFrame() if self.raw else None})
+
+            # Vision is done with the camera frame, so it can be filled again
+            self.vs.release(packet.pop("frame"))
+            fb.log("[INFO] Vision end", True)
+        self.strategySlot.close()
+        self.displaySlot.close()
+
+
+    # Strategy stage: decide how each row should respond
+    def _strategy(self):
+        while True:
+            packet = self.strategySlot.get()
+            if packet is None:
+                break
+            packet["commands"] = self.strategy(packet["state"])
+            packet["timestamps"]["strategy"] = time.perf_counter()
+            self.controlSlot.put(packet)
+        self.controlSlot.close()
+
+
+    # Control stage: send motor commands
+    def _control(self):
+        while True:
+            packet = self.controlSlot.get()
+            if packet is None:
+                break
+            self.control(packet["commands"])
+            packet["timestamps"]["control"] = time.perf_counter()
+            self.completed.append(packet["timestamps"])
+            self.numCompleted += 1
+
+
+    # Get throughput and latency (in ms) of each stage and end-to-end
+    def getStats(self):
+        elapsed = time.perf_counter() - self.startTime if self.startTime is not None else 0
+        stats = {
+            "captured": self.captured,
+            "completed": self.numCompleted,
+            "fps": self.numCompleted / elapsed if elapsed > 0 else 0,
+            "dropped": {
+                "capture": self.missed,
+                "vision": self.visionSlot.dropped,
+                "strategy": self.strategySlot.dropped,
+                "control": self.controlSlot.dropped,
+            },
+        }
+        if len(self.completed) == 0:
+            return stats
+
+        # Latency of each stage is the time since the previous stage's stamp
+        for i in range(1, len(self.stages)):
+            previous, stage = self.stages[i - 1], self.stages[i]
+            ms = np.array([1000 * (t[stage] - t[previous]) for t in self.completed])
+            stats[stage] = {"p50": float(np.percentile(ms, 50)), "p95": float(np.percentile(ms, 95))}
+
+        ms = np.array([1000 * (t["control"] - t["capture"]) for t in self.completed])
+        stats["endToEnd"] = {"p50": float(np.percentile(ms, 50)), "p95": float(np.percentile(ms, 95)), "max": float(ms.max())}
+        return stats
@@ -0,0 +1,146 @@
+#########################
+# Automated Foosball    #
+#########################
+
+# This class tracks a player's foosmen rods (ie the opponent's) from frame to frame
+# Each rod's foosmen move together, so each rod only has a few values to track: its offset (the y-coordinate
+# of the first foosman's center, in pixels), how fast that is changing, and the angle the foosmen are turned to.
+# Detections update these with an alpha-beta filter, and in between (or while a rod's foosmen are hidden, ie by the
+# foosball or a hand) they are predicted forward. This means players only need to be detected every few frames,
+# while strategy still gets every foosman's position, with the same identity (index on the rod), on every frame.
+# https://en.wikipedia.org/wiki/Alpha_beta_filter
+
+# import the necessary packages
+import numpy as np
+
+
+# Predicted foosmen (see PlayerTracker.predict()): rod (row), index on the rod (from the top), position,
+# angle (in degrees, positive when the feet point towards larger x), and time since the rod was last detected
+TRACKED_DTYPE = np.dtype([("row", "i4"), ("index", "i4"), ("x", "i4"), ("y", "f4"), ("angle", "f4"), ("age", "f4")])
+
+
+class RodState:
+
+    # Initialize state of a rod with `players` foosmen, spaced `spacing` pixels apart
+    def __init__(self, row, x, players, spacing):
+
+        self.row = row
+        self.x = x
+        self.players = players
+        self.spacing = spacing
+        self.reset()
+
+
+    # Clear state, so the next detection starts a new track
+    def reset(self):
+        self.offset = None
+        self.velocity = 0.0
+        self.angle = 0.0
+        self.time = None
+
+
+    # Return True once the rod has been detected
+    def isInitialized(self):
+        return self.offset is not None
+
+
+    # Get the offset at time `t`, extrapolated for at most `maxPredictTime` seconds
+    def predictOffset(self, t, maxPredictTime):
+        return self.offset + self.velocity * min(max(t - self.time, 0), maxPredictTime)
+
+
+class PlayerTracker:
+
+    # Initialize tracker for the given rows (see Foosball.vars for the layout of each row)
+    # `alpha` and `beta` are how much each detection moves the offset and velocity estimates (0-1)
+    # `maxPredictTime` is how far ahead (in seconds) the offset is extrapolated with its velocity
+    # `maxAge` is how long (in seconds) a rod is predicted without being detected before its track is dropped
+    def __init__(self, rows, rowPosition, foosmenPerRow, foosmenSpacing, foosmenHeight, alpha=0.9, beta=0.5, maxPredictTime=0.1, maxAge=1.0):
+
+        self.rods = [RodState(row, rowPosition[row], foosmenPerRow[row], foosmenSpacing[row]) for row in rows]
+        self.foosmenHeight = foosmenHeight
+        self.alpha = alpha
+        self.beta = beta
+        self.maxPredictTime = maxPredictTime
+        self.maxAge = maxAge
+
+        # Number of rod detections that started or updated a track, and tracks dropped after `maxAge`
+        self.stats = {"started": 0, "updated": 0, "dropped": 0}
+
+
+    # Return True if every rod is being tracked
+    def isTracking(self):
+        return all(rod.isInitialized() for rod in self.rods)
+
+
+    # Update each rod with the foosmen detected on it at time `t` (see Foosball.findPlayers())
+    # A rod's track starts once all of its foosmen are detected together, since until then it is not known which
+    # foosman each detection is. After that, each detection is matched to the closest predicted foosman.
+    def update(self, players, t):
+        for rod in self.rods:
+            detected = players[players["row"] == rod.row]
+            if len(detected) == 0:
+                continue
+            ys = detected["y"].astype("float64")
+
+            if len(detected) == rod.players:
+                index = np.arange(rod.players)
+            elif rod.isInitialized():
+                predicted = rod.predictOffset(t, self.maxPredictTime)
+                index = np.clip(np.round((ys - predicted) / rod.spacing), 0, rod.players - 1)
+            else:
+                continue
+
+            # Each detection implies an offset for the whole rod, and the median ignores a stray detection
+            offset = float(np.median(ys - index * rod.spacing))
+            angle = float(np.median(self._getAngles(detected, rod.x)))
+
+            if not rod.isInitialized():
+                rod.offset, rod.velocity, rod.angle, rod.time = offset, 0.0, angle, t
+                self.stats["started"] += 1
+                continue
+
+            dt = t - rod.time
+            predicted = rod.predictOffset(t, self.maxPredictTime)
+            residual = offset - predicted
+            rod.offset = predicted + self.alpha * residual
+            if dt > 0:
+                rod.velocity += self.beta * residual / dt
+            rod.angle += self.alpha * (angle - rod.angle)
+            rod.time = t
+            self.stats["updated"] += 1
+
+
+    # Predict every foosman of every tracked rod at time `t`
+    # Returns a structured array (see TRACKED_DTYPE), sorted by rod and then from the top of the table
+    def predict(self, t):
+        predictions = []
+        for rod in self.rods:
+            if not rod.isInitialized():
+                continue
+            if t - rod.time > self.maxAge:
+                rod.reset()
+                self.stats["dropped"] += 1
+                continue
+
+            tracked = np.empty(rod.players, dtype=TRACKED_DTYPE)
+            tracked["row"] = rod.row
+            tracked["index"] = np.arange(rod.players)
+            tracked["x"] = rod.x
+            tracked["y"] = rod.predictOffset(t, self.maxPredictTime) + np.arange(rod.players) * rod.spacing
+            tracked["angle"] = rod.angle
+            tracked["age"] = t - rod.time
+            predictions.append(tracked)
+
+        if len(predictions) == 0:
+            return np.empty(0, dtype=TRACKED_DTYPE)
+        return np.concatenate(predictions)
+
+
+    # Estimate how far each detected foosman is turned, from how far its bounding box reaches past the rod
+    # Standing upright, a foosman reaches about as far on each side of the rod. Turned by `angle`, its feet
+    # reach foosmenHeight * sin(angle) further to one side, which is what the difference measures.
+    def _getAngles(self, detected, x):
+        left = x - detected["bbox"][:, 0]
+        right = detected["bbox"][:, 0] + detected["bbox"][:, 2] - x
+        return np.degrees(np.arcsin(np.clip((right - left) / self.foosmenHeight, -1, 1)))
@@ -0,0 +1,92 @@
+#########################
+# Automated Foosball    #
+#########################
+
+# This class plans the speed of a stepper motor over a move, as a list of per-step delays
+# A stepper motor cannot jump straight to a high speed without skipping steps, so each move
+# accelerates from a safe starting speed, cruises at the maximum speed, then decelerates.
+#
+# "trapezoid" uses constant acceleration, so speed ramps up and down linearly
+# "scurve" smooths the start and end of each ramp (limited jerk), which is gentler on the motor under load
+#
+# Delays are the time (in seconds) the PUL pin is held high, then low, for each step,
+# which is the same meaning as Foosmen.delay
+
+# import the necessary packages
+import numpy as np
+
+
+class MotionProfile:
+
+    # Initialize profile
+    # Speeds are in steps/s and acceleration is in steps/s^2
+    def __init__(self, startSpeed, maxSpeed, acceleration, shape="trapezoid"):
+        if shape not in ("trapezoid", "scurve"):
+            raise ValueError("Invalid motion profile shape: {}".format(shape))
+
+        self.startSpeed = float(startSpeed)
+        self.maxSpeed = max(float(maxSpeed), self.startSpeed)
+        self.acceleration = float(acceleration)
+        self.shape = shape
+
+        # Delays are cached by number of steps, since the same moves are repeated constantly
+        self.cache = {}
+
+
+    # Create a profile that always moves at a fixed delay per step (no acceleration)
+    @classmethod
+    def constant(cls, delay):
+        speed = 1 / (2 * delay)
+        return cls(speed, speed, 0)
+
+
+    # Get the per-step delays (in seconds) for a move of `steps` steps
+    # The returned array is cached and read-only
+    def getDelays(self, steps):
+        steps = int(steps)
+        delays = self.cache.get(steps)
+        if delays is None:
+            delays = self._plan(steps)
+            delays.setflags(write=False)
+            self.cache[steps] = delays
+        return delays
+
+
+    # Get the total time (in seconds) for a move of `steps` steps
+    def getDuration(self, steps):
+        return 2 * float(self.getDelays(steps).sum())
+
+
+    # Calculate the speed at each step, then convert to delays
+    def _plan(self, steps):
+        if steps <= 0:
+            return np.zeros(0)
+
+        # Steps needed to reach maximum speed
+        # With constant acceleration, v^2 = v0^2 + 2 * a * n
+        if self.acceleration > 0:
+            rampSteps = (self.maxSpeed ** 2 - self.startSpeed ** 2) / (2 * self.acceleration)
+        else:
+            rampSteps = 0
+
+        # An S-curve ramp takes twice as long to reach the same average acceleration
+        if self.shape == "scurve":
+            rampSteps *= 2
+
+        # Short moves never reach maximum speed, so they accelerate for half and decelerate for half
+        n = np.arange(steps, dtype="float64")
+        distanceToEnd = steps - 1 - n
+        rampPosition = np.minimum(n, distanceToEnd)
+
+        if rampSteps < 1:
+            speeds = np.full(steps, self.maxSpeed)
+        elif self.shape == "trapezoid":
+            speeds = np.sqrt(self.startSpeed ** 2 + 2 * self.acceleration * rampPosition)
+            speeds = np.minimum(speeds, self.maxSpeed)
+        else:
+            # Smootherstep goes from 0 to 1 with zero slope and curvature at both ends
+            x = np.minimum(rampPosition / rampSteps, 1)
+            smooth = x * x * x * (x * (x * 6 - 15) + 10)
+            speeds = self.startSpeed + (self.maxSpeed - self.startSpeed) * smooth
+
+        return 1 / (2 * speeds)
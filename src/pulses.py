@@ -0,0 +1,290 @@
+#########################
+# Automated Foosball    #
+#########################
+
+# These classes generate the step pulses sent to the TB6600 stepper motor drivers
+# Each step is one pulse on the PUL pin: high for `delay` seconds, then low for `delay` seconds
+#
+# GPIOPulses toggles pins with RPi.GPIO and time.sleep(), which is simple but jittery,
+# since every edge depends on the Python thread being scheduled on time.
+#
+# PigpioPulses builds waveforms with pigpio, which are played back by the Pi's DMA hardware with
+# microsecond timing while the Python thread just waits. pigpio only plays one waveform at a time,
+# so a single thread combines the pulses of every row that is moving into one short waveform per tick.
+# This requires the pigpio daemon to be running (sudo pigpiod).
+# http://abyz.me.uk/rpi/pigpio/python.html#wave_add_generic
+
+# import the necessary packages
+import time
+from threading import Condition, Event, Thread
+
+
+class GPIOPulses:
+
+    # Initialize GPIO
+    def __init__(self):
+        import RPi.GPIO as io
+        self.io = io
+
+        # Use broadcom pin-numbering scheme for GPIO pins
+        # These pin numbers follow the lower-level numbering system defined by the Raspberry Pi's Broadcom-chip brain
+        self.io.setmode(self.io.BCM)
+
+
+    # Set pin as output
+    def setup(self, pin):
+        self.io.setup(pin, self.io.OUT)
+
+
+    # Set pin high (1) or low (0)
+    def output(self, pin, value):
+        self.io.output(pin, value)
+
+
+    # Send one pulse per delay (in seconds) on each pin
+    # `trains` is a list of (pin, delays) or (pin, delays, starts) tuples, and all trains are played back
+    # on the same timeline. Without `starts`, pulses follow each other back to back. Otherwise `starts`
+    # is the time (in seconds, from the beginning of the move) at which each pulse begins.
+    # If `cancel` (a threading.Event) is set, stop early
+    # Returns the number of pulses sent on each pin, in the same order as `trains`
+    def pulse(self, trains, cancel=None):
+        sent = [0] * len(trains)
+        high = [False] * len(trains)
+        for edgeTime, index, value in _edges(trains):
+            if cancel is not None and cancel.is_set():
+                break
+            if edgeTime is not None:
+                delay = edgeTime - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            self.io.output(trains[index][0], value)
+            high[index] = value == 1
+            if value == 1:
+                sent[index] += 1
+
+        # A step starts on its rising edge, so a pin left high when cancelled has sent that step, and is set low
+        for index, train in enumerate(trains):
+            if high[index]:
+                self.io.output(train[0], 0)
+        return sent
+
+
+    # Reset GPIO pins
+    def cleanup(self):
+        self.io.cleanup()
+
+
+class PigpioPulses:
+
+    # Length of each waveform (in seconds)
+    # Every row's pulses are combined into one waveform per tick, and a new move starts on the next tick
+    tick = 0.01
+
+    # Initialize connection to pigpio daemon, and start the thread that sends waveforms
+    def __init__(self, host="localhost", port=8888):
+        import pigpio
+        self.pigpio = pigpio
+        self.pi = pigpio.pi(host, port)
+        if not self.pi.connected:
+            raise RuntimeError("Unable to connect to pigpio daemon at {}:{}".format(host, port))
+        self.pi.wave_clear()
+
+        # Moves being sent, and moves that have been sent but are still playing
+        self.moves = []
+        self.finishing = []
+        self.condition = Condition()
+        self.stopped = False
+
+        # The exception that stopped the transmit thread, raised again from every later pulse()
+        self.error = None
+
+        self.thread = Thread(target=self._transmit, args=())
+        self.thread.daemon = True
+        self.thread.start()
+
+
+    # Set pin as output
+    def setup(self, pin):
+        self.pi.set_mode(pin, self.pigpio.OUTPUT)
+
+
+    # Set pin high (1) or low (0)
+    def output(self, pin, value):
+        self.pi.write(pin, value)
+
+
+    # Send the pulse trains, and wait until they finish
+    # pigpio plays one waveform at a time, so the pulses are sent by the transmit thread along with those of every
+    # other row moving at the same time (see _transmit())
+    # This has the same arguments and return value as GPIOPulses.pulse()
+    # Raises RuntimeError if sending waveforms failed, so the move is not silently skipped
+    def pulse(self, trains, cancel=None):
+        move = {
+            "edges": _waveEdges(trains),
+            "next": 0,
+            "start": None,
+            "end": None,
+            "pins": sum(1 << train[0] for train in trains),
+            "sent": [0] * len(trains),
+            "cancel": cancel,
+            "done": Event(),
+        }
+        if len(move["edges"]) == 0:
+            return move["sent"]
+
+        with self.condition:
+            self._checkError()
+            if self.stopped:
+                return move["sent"]
+            self.moves.append(move)
+            self.condition.notify_all()
+        move["done"].wait()
+        self._checkError()
+        return move["sent"]
+
+
+    # Stop sending waveforms and disconnect
+    def cleanup(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        self.thread.join(1.0)
+        self.pi.wave_tx_stop()
+        self.pi.wave_clear()
+        self.pi.stop()
+
+
+    # Send one waveform per tick, with the pulses of every move that fall within it
+    # Each waveform is queued to start as soon as the one playing ends (WAVE_MODE_ONE_SHOT_SYNC), and only one is
+    # queued ahead at a time, so only a few small waveforms use pigpio's pulse and control block memory at once
+    # A new move joins on the next tick, and a cancelled move stops on the next tick (with its pins set low)
+    # Moves still waiting when this stops (or if pigpio fails) are released, so no row waits forever
+    def _transmit(self):
+        try:
+            self._sendWaveforms()
+        except Exception as e:
+            self.error = e
+        finally:
+            with self.condition:
+                self.stopped = True
+                for move in self.moves + self.finishing:
+                    move["done"].set()
+                self.moves = []
+                self.finishing = []
+
+
+    # Send waveforms until stopped (see _transmit())
+    def _sendWaveforms(self):
+        tickMicros = int(round(self.tick * 1000000))
+        timeline = 0
+        waves = []
+        playingUntil = time.perf_counter()
+        while True:
+            with self.condition:
+                self._finishMoves()
+                while len(self.moves) == 0 and not self.stopped:
+                    timeout = min(move["end"] for move in self.finishing) - time.perf_counter() if self.finishing else None
+                    self.condition.wait(timeout)
+                    self._finishMoves()
+                if self.stopped:
+                    break
+
+                # Collect the edges of every move within this tick, in timeline microseconds
+                windowEnd = timeline + tickMicros
+                edges = {}
+                waveStart = max(time.perf_counter(), playingUntil)
+                for move in list(self.moves):
+                    if move["start"] is None:
+                        move["start"] = timeline
+                    if move["cancel"] is not None and move["cancel"].is_set():
+                        edges.setdefault(timeline, [0, 0])[1] |= move["pins"]
+                        move["next"] = len(move["edges"])
+                    while move["next"] < len(move["edges"]):
+                        t, pins, value, index = move["edges"][move["next"]]
+                        t += move["start"]
+                        if t >= windowEnd:
+                            break
+                        edges.setdefault(t, [0, 0])[1 - value] |= pins
+                        if value == 1:
+                            move["sent"][index] += 1
+                        move["next"] += 1
+                    if move["next"] == len(move["edges"]):
+                        move["end"] = waveStart + self.tick
+                        self.moves.remove(move)
+                        self.finishing.append(move)
+
+            # Build the waveform, padded to exactly one tick
+            times = sorted(edges)
+            pulses = []
+            if len(times) == 0 or times[0] > timeline:
+                pulses.append(self.pigpio.pulse(0, 0, (times[0] if times else windowEnd) - timeline))
+            for i, t in enumerate(times):
+                on, off = edges[t]
+                pulses.append(self.pigpio.pulse(on, off, (times[i + 1] if i + 1 < len(times) else windowEnd) - t))
+            self.pi.wave_add_generic(pulses)
+            wave = self.pi.wave_create()
+            self.pi.wave_send_using_mode(wave, self.pigpio.WAVE_MODE_ONE_SHOT_SYNC)
+            waves.append((wave, waveStart + self.tick))
+            timeline = windowEnd
+
+            # Wait until the previous waveform ends, then delete any that have finished playing
+            time.sleep(max(playingUntil - time.perf_counter(), 0))
+            playingUntil = waveStart + self.tick
+            current = self.pi.wave_tx_at()
+            while len(waves) > 1 and waves[0][0] != current and waves[0][1] <= time.perf_counter():
+                self.pi.wave_delete(waves.pop(0)[0])
+
+
+    # Raise an error if the transmit thread failed
+    def _checkError(self):
+        if self.error is not None:
+            raise RuntimeError("Sending pigpio waveforms failed: {!r}".format(self.error)) from self.error
+
+
+    # Release moves whose last waveform has finished playing
+    def _finishMoves(self):
+        now = time.perf_counter()
+        for move in list(self.finishing):
+            if move["end"] <= now:
+                self.finishing.remove(move)
+                move["done"].set()
+
+
+# Get the time (in seconds, from the beginning of the move) at which each pulse of a train begins
+def _starts(train):
+    if len(train) > 2 and train[2] is not None:
+        return train[2]
+    starts = []
+    t = 0
+    for delay in train[1]:
+        starts.append(t)
+        t += 2 * delay
+    return starts
+
+
+# Get every edge of the pulse trains in time order, as (time, train index, value)
+# Times are absolute (time.perf_counter), starting now, and the first edge has no wait
+def _edges(trains):
+    edges = []
+    for index, train in enumerate(trains):
+        for start, delay in zip(_starts(train), train[1]):
+            edges.append((start, index, 1))
+            edges.append((start + delay, index, 0))
+    edges.sort(key=lambda e: (e[0], e[2]))
+
+    startTime = time.perf_counter()
+    for i, (t, index, value) in enumerate(edges):
+        yield (startTime + t) if i > 0 else None, index, value
+
+
+# Get every edge of the pulse trains in time order, as (time in microseconds, pin bit mask, value, train index)
+def _waveEdges(trains):
+    edges = []
+    for index, train in enumerate(trains):
+        pins = 1 << train[0]
+        for start, delay in zip(_starts(train), train[1]):
+            t = int(round(start * 1000000))
+            edges.append((t, pins, 1, index))
+            edges.append((t + int(round(delay * 1000000)), pins, 0, index))
+    edges.sort(key=lambda e: (e[0], e[2]))
+    return edges
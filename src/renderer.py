@@ -0,0 +1,96 @@
+#########################
+# Automated Foosball    #
+#########################
+
+# This class builds the output frame shown on screen or recorded: the table image with detections drawn on it,
+# and lines of key metrics below it. Output frames come from a FrameRing of preallocated buffers, and detectors
+# draw straight onto the table image of the buffer being built (see getImage()), so nothing is copied or allocated.
+#
+# Only what changed is redrawn. Every buffer keeps the text last drawn on each metric line, and a line is only
+# drawn again if its text is different. Each line is drawn into its own small strip with cv2.putText() and copied
+# into place, and the last strip of each line is cached, so a value that changed since a buffer was last used
+# but has not changed since (ie "Detect Ball: True") is copied instead of drawn again.
+
+# import the necessary packages
+import cv2
+import numpy as np
+
+from framering import FrameRing
+
+
+class OutputRenderer:
+
+    # Height of each line of metrics, in pixels
+    lineHeight = 18
+
+    # Initialize `buffers` output frames of `size` (width, height), with a table image of `tableSize` at the top
+    # Metrics are drawn in two columns below the table: left aligned on the left, and right aligned on the right
+    # Output frames are handed out until they are released, so this needs 2 more buffers than are held at once
+    def __init__(self, size, tableSize, font, buffers=4):
+
+        width, height = size
+        self.tableWidth, self.tableHeight = tableSize
+        self.width = width
+        self.font = font
+
+        self.ring = FrameRing((height, width, 3), buffers)
+        for buffer in self.ring.buffers:
+            buffer[:] = 0
+
+        # Text of every line drawn on each buffer, and the last strip drawn for each line, both by (column, row)
+        self.drawn = {id(buffer): {} for buffer in self.ring.buffers}
+        self.strips = {}
+
+
+    # Get the table image of the output frame being built, for detectors to draw on
+    def getImage(self):
+        return self.ring.getBuffer()[:self.tableHeight, :self.tableWidth]
+
+
+    # Draw a line of text below the table, in `column` 0 (left) or 1 (right), `row` lines down
+    def drawText(self, column, row, text):
+        buffer = self.ring.getBuffer()
+        drawn = self.drawn[id(buffer)]
+        key = (column, row)
+        if drawn.get(key) == text:
+            return
+
+        strip = self.strips.get(key)
+        if strip is None or strip[0] != text:
+            strip = (text, self._drawStrip(column, text))
+            self.strips[key] = strip
+
+        # Lines are spaced so their strips are just touching, with the baseline 4 pixels from the bottom
+        y0 = self.tableHeight + 4 + self.lineHeight * row + 4
+        x0 = column * (self.width // 2)
+        image = strip[1]
+        np.copyto(buffer[y0:y0 + image.shape[0], x0:x0 + image.shape[1]], image)
+        drawn[key] = text
+
+
+    # Finish the output frame being built, and start the next one
+    # Returns the output frame, which is not reused until it is passed to release(), or None if every buffer is held
+    def finish(self):
+        if not self.ring.publish(0, 0):
+            return None
+        frame, seq, timestamp = self.ring.take()
+        return frame
+
+
+    # Give an output frame returned by finish() back, so it can be reused
+    def release(self, frame):
+        self.ring.release(frame)
+
+
+    # Draw the text of a line on a strip as wide as its column
+    # The width of right aligned text is measured with a thickness of 2, so the columns line up with earlier output
+    def _drawStrip(self, column, text):
+        x0 = column * (self.width // 2)
+        strip = np.zeros((self.lineHeight, self.width // 2 if column == 0 else self.width - x0, 3), dtype="uint8")
+        if column == 0:
+            textX = 10
+        else:
+            textsize = cv2.getTextSize(text, self.font, 1, 2)[0]
+            textX = self.width - textsize[0] - 10 - x0
+        cv2.putText(strip, text, (int(textX), self.lineHeight - 4), self.font, 1, (255, 255, 255), 1)
+        return strip
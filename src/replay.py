@@ -0,0 +1,225 @@
+#########################
+# Automated Foosball    #
+#########################
+
+# This class replays a recorded session as if it were a live camera stream
+# It has the same start() / read() / stop() interface as camera.videoStream, so it can
+# be used to profile or test the vision pipeline without the table hardware
+
+# import the necessary packages
+import cv2
+import glob
+import numpy as np
+import os
+import time
+from threading import Thread
+from framering import FrameRing
+
+
+class replayStream:
+
+    # Initialize
+    # `path` is either a video file (such as the MJPG/AVI written by `main.py --output`)
+    # or a directory of PNG images, which are played back in filename order
+    # `realtime` paces frames at the recorded FPS, otherwise frames are returned as fast as possible
+    # `loop` restarts from the first frame once the end of the recording is reached
+    # `preload` decodes every frame into memory up front so file decoding is not part of any timing
+    # Frames are decoded into a ring of `buffers` preallocated frames, like camera.videoStream
+    # `format` is "bgr", or "yuv" to convert each frame to YUV420 like camera.videoStream captures it
+    def __init__(self, path, realtime=True, loop=False, framerate=None, preload=False, buffers=5, format="bgr"):
+
+        self.path = path
+        self.realtime = realtime
+        self.loop = loop
+        self.preload = preload
+        self.format = format
+
+        # Directory of PNG images
+        self.files = None
+        self.capture = None
+        if os.path.isdir(path):
+            self.files = sorted(glob.glob(os.path.join(path, "*.png")))
+            if len(self.files) == 0:
+                raise ValueError("No PNG images found in {}".format(path))
+            recordedFramerate = None
+            shape = cv2.imread(self.files[0]).shape
+
+        # Video file
+        else:
+            self.capture = cv2.VideoCapture(path)
+            if not self.capture.isOpened():
+                raise ValueError("Unable to open recorded video {}".format(path))
+            recordedFramerate = self.capture.get(cv2.CAP_PROP_FPS)
+            shape = (int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH)), 3)
+
+        # Use the recorded FPS unless one is given, otherwise default to 30fps
+        self.framerate = framerate or recordedFramerate or 30
+
+        # Decode all frames into memory
+        self.index = 0
+        self.frames = None
+        if self.preload:
+            frames = []
+            frame = self._decode()
+            while frame is not None:
+                frames.append(frame)
+                frame = self._decode()
+            if len(frames) == 0:
+                raise ValueError("No frames found in {}".format(path))
+            self.frames = frames
+            self.index = 0
+            self._release()
+
+        # initialize the frame and the variable used to indicate
+        # if the thread should be stopped
+        self.frame = None
+        self.stopped = False
+
+        # Frames are numbered and timestamped like camera.videoStream
+        # When not in real-time mode, timestamps follow the recorded FPS starting from the first read()
+        self.seq = 0
+        self.startClock = None
+
+        # YUV420 frames are decoded as BGR first, then converted into the ring
+        if self.preload:
+            shape = self.frames[0].shape
+        self.decoded = None
+        if format == "yuv":
+            self.decoded = np.empty(shape, dtype="uint8")
+            shape = (shape[0] * 3 // 2, shape[1])
+        self.ring = FrameRing(shape, buffers)
+
+
+    # Start stream
+    # In real-time mode, frames are read on a separate thread just like the camera
+    def start(self):
+        if self.realtime:
+            t = Thread(target=self.update, args=())
+            t.daemon = True
+            t.start()
+        return self
+
+
+    def update(self):
+        interval = 1.0 / self.framerate
+        nextTime = time.perf_counter()
+
+        # keep looping until the recording ends or the thread is stopped
+        while not self.stopped:
+            if not self._fill(time.perf_counter()):
+                self.stop()
+                break
+
+            # Wait until the next frame is due, based on the recorded FPS
+            nextTime += interval
+            delay = nextTime - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                nextTime = time.perf_counter()
+
+        self._release()
+
+
+    # Return the newest frame, its sequence number, and its timestamp, with the same arguments as camera.videoStream
+    # When not in real-time mode, every call returns the next recorded frame, so `wait` has no effect
+    # The frame is `None` once the recording has ended
+    def read(self, wait=False, timeout=None, hold=False):
+        if self.frame is not None:
+            self.ring.release(self.frame)
+            self.frame = None
+
+        if not self.realtime:
+            if self.stopped:
+                return None, self.seq, None
+            if self.startClock is None:
+                self.startClock = time.perf_counter()
+            if not self._fill(self.startClock + self.seq / self.framerate):
+                self.stop()
+                return None, self.seq, None
+
+        taken = self.ring.take(wait, timeout)
+        if taken is None:
+            return None, self.seq, None
+        frame, seq, timestamp = taken
+        if not hold:
+            self.frame = frame
+        return frame, seq, timestamp
+
+
+    # Give a frame read with `hold` back to the ring
+    def release(self, frame):
+        self.ring.release(frame)
+
+
+    def stop(self):
+        # indicate that the thread should be stopped
+        self.stopped = True
+        self.ring.close()
+        if not self.realtime:
+            self._release()
+
+
+    # Decode the next recorded frame into the ring and publish it
+    # Returns False once the recording has ended
+    def _fill(self, timestamp):
+        if self.decoded is not None:
+            if not self._next(self.decoded):
+                return False
+            cv2.cvtColor(self.decoded, cv2.COLOR_BGR2YUV_I420, dst=self.ring.getBuffer())
+        elif not self._next(self.ring.getBuffer()):
+            return False
+        self.seq += 1
+        self.ring.publish(self.seq, timestamp)
+        return True
+
+
+    # Get the next recorded frame, rewinding to the first frame if looping
+    # If `out` is given, the frame is decoded into it, and True is returned instead of the frame
+    def _next(self, out=None):
+        frame = self._decode(out)
+        if frame is None and self.loop and self.index > 0:
+            self._rewind()
+            frame = self._decode(out)
+        return frame
+
+
+    # Decode the next frame from memory, the image directory, or the video file
+    def _decode(self, out=None):
+        if self.frames is not None:
+            if self.index >= len(self.frames):
+                return None
+            frame = self.frames[self.index]
+
+        elif self.files is not None:
+            if self.index >= len(self.files):
+                return None
+            frame = cv2.imread(self.files[self.index])
+
+        else:
+            if self.capture is None:
+                return None
+            ok, frame = self.capture.read(out)
+            if not ok:
+                return None
+
+        self.index += 1
+        if out is None:
+            return frame
+        if frame is not out:
+            np.copyto(out, frame)
+        return True
+
+
+    # Go back to the first recorded frame
+    def _rewind(self):
+        self.index = 0
+        if self.frames is None and self.capture is not None:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+
+    # Release video file
+    def _release(self):
+        if self.capture is not None:
+            self.capture.release()
+            self.capture = None
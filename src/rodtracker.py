@@ -0,0 +1,84 @@
+#########################
+# Automated Foosball    #
+#########################
+
+# This class keeps a row of foosmen's believed position in line with what the camera sees
+# Foosmen.position is dead reckoning (it just counts steps), so any skipped steps make it drift.
+# Each frame, the detected foosmen on the row are matched to where the row thinks they are,
+# the difference is smoothed over a few frames, and the row is re-zeroed once the drift is clear.
+
+# import the necessary packages
+import numpy as np
+
+
+class RodTracker:
+
+    # Initialize tracker for a foosmen row
+    # `firstPlayerY` is the y-coordinate (in pixels) of the first foosman's center when the row is at position 0
+    # `direction` is 1 if the foosmen move down the frame as position increases, otherwise -1
+    # `gain` is how much each frame's measurement moves the drift estimate (0-1)
+    # `threshold` is how far (in pixels) the drift must be before the row is re-zeroed
+    def __init__(self, row, firstPlayerY, direction, gain=0.3, threshold=3, minPlayers=2):
+
+        self.row = row
+        self.firstPlayerY = firstPlayerY
+        self.direction = direction
+        self.gain = gain
+        self.threshold = threshold
+        self.minPlayers = minPlayers
+
+        # Estimated difference between the true and believed position (in pixels)
+        self.drift = 0.0
+        self.measurements = 0
+        self.corrections = 0
+
+
+    # Get the expected y-coordinate of each foosman on the row at a given position
+    def getExpectedPositions(self, position=None):
+        if position is None:
+            position = self.row.position
+        return self.firstPlayerY + self.direction * position + np.arange(self.row.players) * self.row.playerSpacing
+
+
+    # Measure the row position from detected foosmen y-coordinates
+    # Each detection is matched to the nearest foosman, and the median offset is used so that
+    # a missed or false detection does not throw off the estimate
+    # Returns None if not enough foosmen were detected
+    def measurePosition(self, ys):
+        ys = np.asarray(ys, dtype="float64")
+        if len(ys) < min(self.minPlayers, self.row.players):
+            return None
+
+        # Index of the foosman closest to each detection, assuming the row is where we think it is
+        base = self.firstPlayerY + self.direction * self.row.position
+        index = np.clip(np.round((ys - base) / self.row.playerSpacing), 0, self.row.players - 1)
+
+        # Each detection implies a position for the whole row
+        positions = self.direction * (ys - self.firstPlayerY - index * self.row.playerSpacing)
+        return float(np.median(positions))
+
+
+    # Update drift estimate with the foosmen detected on this frame, and re-zero the row if needed
+    # Measurements are skipped while the row is moving, since its position is changing between
+    # when the frame was captured and when it is processed
+    # Returns True if the row position was corrected
+    def update(self, ys, moving=False):
+        if moving:
+            return False
+
+        measured = self.measurePosition(ys)
+        if measured is None:
+            return False
+
+        # Smooth the measured drift over several frames
+        self.measurements += 1
+        self.drift += self.gain * ((measured - self.row.position) - self.drift)
+
+        # Re-zero once the drift is clearly larger than detection noise
+        if abs(self.drift) < self.threshold:
+            return False
+
+        self.row.correct(self.drift)
+        self.drift = 0.0
+        self.corrections += 1
+        return True
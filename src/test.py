@@ -33,8 +33,8 @@ fb = Foosball(False).start()
 ##########################################################################
 
 # Read frame from camera stream and update FPS counter
-rawFrame = vs.read()
-fb.readFrame(rawFrame)
+rawFrame, seq, timestamp = vs.read(True)
+fb.readFrame(rawFrame, timestamp, vs.format)
 
 # Because the camera or table can move during play, we place ArUco markers
 # in each corner of the foosball table and then detect them in real time.
@@ -46,8 +46,7 @@ fb.findTable()
 fb.findBall()
 
 # Find location of the players
-fb.findPlayers("RED")
-fb.findPlayers("BLUE")
+fb.findAllPlayers(None)
 
 
 ##########################################################################
@@ -0,0 +1,46 @@
+#########################
+# Automated Foosball    #
+#########################
+
+# Functions to predict where the foosball will cross each foosmen rod
+# The ball travels in a straight line and bounces off the top and bottom walls any number of times.
+# Instead of simulating each bounce, the table is "unfolded": the ball moves in a straight line
+# through mirrored copies of the table, and the result is folded back into the real table.
+# This lets every rod be computed at once with NumPy, in a few microseconds.
+
+# import the necessary packages
+import numpy as np
+
+
+# Fold unbounded y-coordinates back onto the table, reflecting off walls at `lower` and `upper`
+def foldIntoTable(y, lower, upper):
+    span = upper - lower
+    if span <= 0:
+        return np.full_like(np.asarray(y, dtype="float64"), lower)
+    period = 2 * span
+    u = np.mod(np.asarray(y, dtype="float64") - lower, period)
+    return lower + np.where(u <= span, u, period - u)
+
+
+# Get the y-coordinate and arrival time of the foosball at each rod x-coordinate
+# `position` is (x, y) in pixels and `velocity` is (vx, vy) in pixels/s
+# `height` is the table height and `radius` is the foosball radius, both in pixels
+# Returns two arrays the same length as `rodX`: y-coordinate (pixels) and time until arrival (seconds)
+# Rods the ball is moving away from (or any rod, if the ball is not moving across the table) are NaN
+def getRodIntercepts(position, velocity, rodX, height, radius=0):
+    x0, y0 = position
+    vx, vy = velocity
+    rodX = np.asarray(rodX, dtype="float64")
+
+    # Time until the ball reaches each rod
+    if vx == 0:
+        t = np.full(rodX.shape, np.nan)
+    else:
+        t = (rodX - x0) / vx
+        t[t < 0] = np.nan
+
+    # The center of the ball bounces when it is `radius` away from either wall
+    y = foldIntoTable(y0 + vy * t, radius, height - radius)
+    y[np.isnan(t)] = np.nan
+
+    return y, t